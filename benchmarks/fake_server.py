@@ -0,0 +1,163 @@
+import asyncio
+import random
+from types import SimpleNamespace
+from typing import Dict, Optional
+
+from telethon.errors import FloodWaitError, RpcCallFailError
+from telethon.tl.functions.upload import (
+    GetFileRequest,
+    SaveBigFilePartRequest,
+    SaveFilePartRequest,
+)
+from telethon.tl.types import Document
+
+from bot.FastTelethon import get_sender_pool
+
+
+class Link:
+    """
+    A line with a fixed number of bytes per second, the parts going
+    through it wait for each other. Without a rate it's instant.
+    """
+
+    def __init__(self, rate: Optional[float] = None) -> None:
+        self.rate = rate
+        self.lock = asyncio.Lock()
+
+    async def transmit(self, size: int) -> None:
+        if self.rate:
+            async with self.lock:
+                await asyncio.sleep(size / self.rate)
+
+
+class FakeSender:
+    """
+    Stands in for the MTProtoSender of one connection.
+    """
+
+    def __init__(self, dc_id: int, bandwidth: Optional[float]) -> None:
+        self.dc_id = dc_id
+        self.link = Link(bandwidth)
+        self.connected = True
+
+    def is_connected(self) -> bool:
+        return self.connected
+
+    async def disconnect(self) -> None:
+        self.connected = False
+
+
+class FakeFileServer:
+    """
+    Answers GetFileRequest, SaveFilePartRequest and SaveBigFilePartRequest
+    from memory, like telegram would, so the transfers can be measured
+    without the network. Every request takes the latency to get its
+    answer, the bytes go through the bandwidth of their connection and
+    of the whole server, and some of them fail:
+
+        error_rate, an internal error, that telethon sends again
+        flood_rate, a FloodWait of flood_seconds for the transfer itself
+    """
+
+    def __init__(
+        self,
+        latency: float = 0.02,
+        bandwidth: Optional[float] = None,
+        total_bandwidth: Optional[float] = None,
+        error_rate: float = 0,
+        flood_rate: float = 0,
+        flood_seconds: int = 1,
+        seed: int = 0,
+    ) -> None:
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.link = Link(total_bandwidth)
+        self.error_rate = error_rate
+        self.flood_rate = flood_rate
+        self.flood_seconds = flood_seconds
+        self.random = random.Random(seed)
+
+        self.files: Dict[int, bytes] = {}
+        self.uploads: Dict[int, Dict[int, bytes]] = {}
+
+        self.requests = 0
+        self.errors = 0
+        self.floods = 0
+
+    def add_file(self, document_id: int, data: bytes, dc_id: int = 2):
+        self.files[document_id] = data
+        return Document(
+            id=document_id,
+            access_hash=0,
+            file_reference=b"",
+            date=None,
+            mime_type="application/octet-stream",
+            size=len(data),
+            dc_id=dc_id,
+            attributes=[],
+        )
+
+    def uploaded(self, file_id: int) -> bytes:
+        parts = self.uploads.get(file_id, {})
+        return b"".join(parts[part] for part in sorted(parts))
+
+    async def call(self, sender: FakeSender, request) -> object:
+        self.requests += 1
+
+        if isinstance(request, GetFileRequest):
+            data = self.files[request.location.id]
+            data = data[request.offset:request.offset + request.limit]
+            sent, received = 0, len(data)
+        else:
+            data = request.bytes
+            sent, received = len(data), 0
+
+        await sender.link.transmit(sent)
+        await self.link.transmit(sent)
+        await asyncio.sleep(self.latency)
+
+        chance = self.random.random()
+        if chance < self.flood_rate:
+            self.floods += 1
+            raise FloodWaitError(request=request, capture=self.flood_seconds)
+        if chance < self.flood_rate + self.error_rate:
+            self.errors += 1
+            raise RpcCallFailError(request=request)
+
+        await sender.link.transmit(received)
+        await self.link.transmit(received)
+
+        if isinstance(request, GetFileRequest):
+            return SimpleNamespace(bytes=data)
+
+        if isinstance(request, (SaveFilePartRequest, SaveBigFilePartRequest)):
+            self.uploads.setdefault(request.file_id, {})[
+                request.file_part
+            ] = bytes(data)
+        return True
+
+
+class FakeClient:
+    """
+    The bits of TelegramClient the parallel transfers use. Its sender
+    pool connects to the fake server, and like telethon, the requests
+    that fail with an internal error are sent again.
+    """
+
+    def __init__(self, server: FakeFileServer, dc_id: int = 2) -> None:
+        self.server = server
+        self.loop = asyncio.get_running_loop()
+        self.session = SimpleNamespace(dc_id=dc_id, auth_key=None)
+
+        async def connect(dc_id: int) -> FakeSender:
+            return FakeSender(dc_id, server.bandwidth)
+
+        self.pool = get_sender_pool(self)
+        self.pool._connect = connect
+
+    async def _call(self, sender: FakeSender, request) -> object:
+        while True:
+            try:
+                return await self.server.call(sender, request)
+            except RpcCallFailError:
+                continue
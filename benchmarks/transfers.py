@@ -0,0 +1,309 @@
+"""
+Benchmarks fast_download and fast_upload of bot/FastTelethon.py, the
+way the bot uses them, to and from files in a temporary folder, against
+the fake file server. So the preallocation, positional writes and part
+sidecar of the downloads count, and so do the memory mapped reads, MD5
+and upload session of the uploads.
+
+It goes over a sweep of file sizes, connection counts and part sizes,
+reporting the throughput, CPU time and peak memory of each. The results
+are saved as JSON, and compared with an earlier run to show regressions:
+
+    python -m benchmarks.transfers --output before.json
+    python -m benchmarks.transfers --baseline before.json
+
+Memory is measured by tracemalloc in a second run of each case, so
+its overhead doesn't count in the time. It includes the copy of the
+file kept to check the transfer, and for uploads the one the fake
+server keeps. The memory map of the uploads isn't counted.
+"""
+
+import argparse
+import asyncio
+import hashlib
+import itertools
+import json
+import os
+import platform
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+from types import SimpleNamespace
+from typing import Dict, List, Optional
+
+from telethon import helpers
+from telethon.tl.types import InputFile
+
+from benchmarks.fake_server import FakeClient, FakeFileServer
+from bot.FastTelethon import close_sender_pool, fast_download, fast_upload
+from bot.resume import UploadSession
+
+MB = 1024 * 1024
+KB = 1024
+
+
+def _client(
+    server: FakeFileServer,
+    connections: Optional[int],
+    part_size: Optional[int],
+) -> FakeClient:
+    # fast_download and fast_upload ask the tuner, it's pinned to the
+    # case unless it's left to pick
+    client = FakeClient(server)
+    tuner = client.pool.tuner
+    if connections:
+        tuner.connection_count = lambda dc_id, file_size: connections
+    if part_size:
+        tuner.part_size_for = lambda dc_id, file_size: part_size
+    return client
+
+
+async def _download(
+    server: FakeFileServer,
+    size: int,
+    connections: Optional[int],
+    part_size: Optional[int],
+    folder: str,
+) -> None:
+    data = os.urandom(size)
+    document = server.add_file(helpers.generate_random_long(), data)
+    client = _client(server, connections, part_size)
+    file_path = os.path.join(folder, "download.bin")
+
+    try:
+        await fast_download(
+            client=client,
+            message=SimpleNamespace(document=document),
+            file_path=file_path,
+        )
+    finally:
+        await close_sender_pool(client)
+
+    with open(file_path, "rb") as file:
+        assert file.read() == data, "downloaded file doesn't match"
+    assert not os.path.exists(f"{file_path}.parts"), "sidecar left behind"
+
+
+async def _upload(
+    server: FakeFileServer,
+    size: int,
+    connections: Optional[int],
+    part_size: Optional[int],
+    folder: str,
+) -> None:
+    data = os.urandom(size)
+    client = _client(server, connections, part_size)
+    file_path = os.path.join(folder, "upload.bin")
+    with open(file_path, "wb") as file:
+        file.write(data)
+
+    try:
+        uploaded = await fast_upload(client=client, file_path=file_path)
+    finally:
+        await close_sender_pool(client)
+        UploadSession(file_path).remove()
+
+    assert server.uploaded(uploaded.id) == data, "uploaded file doesn't match"
+    if isinstance(uploaded, InputFile):
+        assert (
+            uploaded.md5_checksum == hashlib.md5(data).hexdigest()
+        ), "MD5 of the upload doesn't match"
+
+
+DIRECTIONS = {"download": _download, "upload": _upload}
+
+
+def _run_case(
+    direction: str,
+    size: int,
+    connections: Optional[int],
+    part_size: Optional[int],
+    server_options: Dict,
+) -> Dict:
+    transfer = DIRECTIONS[direction]
+
+    with tempfile.TemporaryDirectory() as folder:
+        server = FakeFileServer(**server_options)
+        started, cpu_started = time.perf_counter(), time.process_time()
+        asyncio.run(transfer(server, size, connections, part_size, folder))
+        elapsed = time.perf_counter() - started
+        cpu = time.process_time() - cpu_started
+
+    with tempfile.TemporaryDirectory() as folder:
+        tracemalloc.start()
+        server_copy = FakeFileServer(**server_options)
+        asyncio.run(
+            transfer(server_copy, size, connections, part_size, folder)
+        )
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+    return {
+        "direction": direction,
+        "size": size,
+        "connections": connections or "auto",
+        "part_size": part_size or "auto",
+        "seconds": round(elapsed, 4),
+        "mb_per_second": round(size / MB / elapsed, 3),
+        "cpu_seconds": round(cpu, 4),
+        "peak_memory_mb": round(peak / MB, 3),
+        "requests": server.requests,
+        "errors": server.errors,
+        "floods": server.floods,
+    }
+
+
+def _key(result: Dict) -> tuple:
+    return (
+        result["direction"],
+        result["size"],
+        str(result["connections"]),
+        str(result["part_size"]),
+    )
+
+
+def _print(results: List[Dict], baseline: Optional[Dict] = None) -> None:
+    print(
+        f"{'direction':<10}{'size MB':>9}{'conns':>7}{'part KB':>9}"
+        f"{'MB/s':>10}{'cpu s':>9}{'peak MB':>9}{'errors':>8}"
+        + (f"{'vs base':>10}" if baseline else "")
+    )
+    for result in results:
+        part_size = result["part_size"]
+        if part_size != "auto":
+            part_size //= KB
+        line = (
+            f"{result['direction']:<10}{result['size'] / MB:>9.1f}"
+            f"{result['connections']!s:>7}{part_size!s:>9}"
+            f"{result['mb_per_second']:>10.2f}{result['cpu_seconds']:>9.3f}"
+            f"{result['peak_memory_mb']:>9.2f}"
+            f"{result['errors'] + result['floods']:>8}"
+        )
+
+        before = baseline.get(_key(result)) if baseline else None
+        if before:
+            change = result["mb_per_second"] / before["mb_per_second"] - 1
+            # Runs differ a little, only a clear drop is flagged
+            flag = " <<" if change < -0.1 else ""
+            line += f"{change:>+9.0%}{flag}"
+        print(line)
+
+
+def _sizes(text: str) -> List[Optional[int]]:
+    return [
+        None if value == "auto" else int(value)
+        for value in text.split(",")
+    ]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Benchmarks the parallel transfers on a fake server"
+    )
+    parser.add_argument(
+        "--directions", default="download,upload",
+        help="download, upload or both, comma separated",
+    )
+    parser.add_argument(
+        "--sizes", default="1,8,32", help="file sizes in MB",
+    )
+    parser.add_argument(
+        "--connections", default="1,4,8,auto",
+        help="connection counts, auto lets the tuner pick",
+    )
+    parser.add_argument(
+        "--part-sizes", default="128,512,auto",
+        help="part sizes in KB, auto lets the tuner pick",
+    )
+    parser.add_argument(
+        "--latency", type=float, default=0.02,
+        help="seconds for the answer of every request",
+    )
+    parser.add_argument(
+        "--bandwidth", type=float, default=8,
+        help="MB/s of each connection, 0 for no cap",
+    )
+    parser.add_argument(
+        "--total-bandwidth", type=float, default=0,
+        help="MB/s of the whole server, 0 for no cap",
+    )
+    parser.add_argument(
+        "--error-rate", type=float, default=0,
+        help="share of requests failing with an internal error",
+    )
+    parser.add_argument(
+        "--flood-rate", type=float, default=0,
+        help="share of requests failing with a FloodWait",
+    )
+    parser.add_argument(
+        "--flood-seconds", type=int, default=1,
+        help="seconds of every FloodWait",
+    )
+    parser.add_argument(
+        "--seed", type=int, default=0,
+        help="seed of the errors, the same one fails the same requests",
+    )
+    parser.add_argument(
+        "--output", default="bench_results.json",
+        help="where the results are saved",
+    )
+    parser.add_argument(
+        "--baseline", help="results of an earlier run to compare with",
+    )
+    args = parser.parse_args()
+
+    server_options = {
+        "latency": args.latency,
+        "bandwidth": args.bandwidth * MB or None,
+        "total_bandwidth": args.total_bandwidth * MB or None,
+        "error_rate": args.error_rate,
+        "flood_rate": args.flood_rate,
+        "flood_seconds": args.flood_seconds,
+        "seed": args.seed,
+    }
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as file:
+            baseline = {
+                _key(result): result
+                for result in json.load(file)["results"]
+            }
+
+    results = []
+    for direction, size, connections, part_size in itertools.product(
+        args.directions.split(","),
+        _sizes(args.sizes),
+        _sizes(args.connections),
+        _sizes(args.part_sizes),
+    ):
+        results.append(
+            _run_case(
+                direction,
+                size * MB,
+                connections,
+                part_size * KB if part_size else None,
+                server_options,
+            )
+        )
+
+    _print(results, baseline)
+
+    with open(args.output, "w") as file:
+        json.dump(
+            {
+                "date": datetime.now().isoformat(timespec="seconds"),
+                "python": platform.python_version(),
+                "machine": platform.machine(),
+                "server": server_options,
+                "results": results,
+            },
+            file,
+            indent=2,
+        )
+    print(f"\nResults saved to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
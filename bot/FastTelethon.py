@@ -5,20 +5,29 @@ import hashlib
 import inspect
 import logging
 import math
+import mmap
 import os
-from collections import defaultdict
+import time
+from collections import defaultdict, deque
+from weakref import WeakKeyDictionary
 from typing import (
     Optional, 
     Callable,
     List,
     AsyncGenerator,
+    Iterator,
     Union,
     Awaitable,
     DefaultDict,
+    Deque,
+    Dict,
     Tuple,
+    Set,
     BinaryIO
 )
 
+from bot.resume import DownloadSidecar, UploadSession
+from bot import metrics
 from telethon import utils, helpers, TelegramClient
 from telethon.crypto import AuthKey
 from telethon.network import MTProtoSender
@@ -27,6 +36,7 @@ from telethon.tl.functions import InvokeWithLayerRequest
 from telethon.tl.functions.auth import (
     ExportAuthorizationRequest, ImportAuthorizationRequest
 )
+from telethon.errors import FloodWaitError, FloodPremiumWaitError
 from telethon.tl.functions.upload import (
     GetFileRequest,
     SaveFilePartRequest,
@@ -61,52 +71,99 @@ TypeLocation = Union[
 ]
 
 
+async def _send_part(
+    client: TelegramClient,
+    sender: MTProtoSender,
+    request: Union[
+        GetFileRequest, SaveFilePartRequest, SaveBigFilePartRequest
+    ],
+    controller: "ThroughputController",
+    size: int = 0,
+    dc_id: int = 0
+):
+    direction = (
+        "download" if isinstance(request, GetFileRequest) else "upload"
+    )
+
+    # Floods too long for telethon to sleep on its own end up here,
+    # the part is sent again once the wait is over
+    while True:
+        started = time.monotonic()
+        try:
+            result = await client._call(sender, request)
+        except (FloodWaitError, FloodPremiumWaitError) as e:
+            log.debug(f"Flood wait of {e.seconds} seconds on a part")
+            metrics.flood_wait_seconds.inc("part", amount=e.seconds)
+            controller.flood()
+            await asyncio.sleep(e.seconds)
+            continue
+
+        elapsed = time.monotonic() - started
+        if isinstance(request, GetFileRequest):
+            size = len(result.bytes)
+        controller.part_done(size, elapsed)
+
+        metrics.part_seconds.observe(elapsed, direction, dc_id)
+        metrics.transfer_bytes.inc(direction, dc_id, amount=size)
+        return result
+
+
 class DownloadSender:
     client: TelegramClient
     sender: MTProtoSender
-    request: GetFileRequest
-    remaining: int
-    stride: int
+    file: TypeLocation
+    part_size: int
+    controller: "ThroughputController"
+    dc_id: int
 
     def __init__(
         self,
         client: TelegramClient,
         sender: MTProtoSender,
         file: TypeLocation,
-        offset: int,
-        limit: int,
-        stride: int,
-        count: int
+        part_size: int,
+        controller: "ThroughputController",
+        dc_id: int = 0
     ) -> None:
 
         self.sender = sender
         self.client = client
-        self.request = GetFileRequest(
-            file, offset=offset, limit=limit
+        self.file = file
+        self.part_size = part_size
+        self.controller = controller
+        self.dc_id = dc_id
+
+    async def next(self, part: int) -> bytes:
+        result = await _send_part(
+            self.client,
+            self.sender,
+            GetFileRequest(
+                self.file,
+                offset=part * self.part_size,
+                limit=self.part_size
+            ),
+            self.controller,
+            dc_id=self.dc_id
         )
-        self.stride = stride
-        self.remaining = count
-
-    async def next(self) -> Optional[bytes]:
-        if not self.remaining:
-            return None
-        result = await self.client._call(self.sender, self.request)
-        self.remaining -= 1
-        self.request.offset += self.stride
         return result.bytes
 
-    def disconnect(self) -> Awaitable[None]:
-        return self.sender.disconnect()
+    async def finish(self) -> None:
+        # Nothing left in flight once the scheduler stops asking for parts
+        return None
 
 
 class UploadSender:
     client: TelegramClient
     sender: MTProtoSender
-    request: Union[SaveFilePartRequest, SaveBigFilePartRequest]
+    file_id: int
     part_count: int
-    stride: int
-    previous: Optional[asyncio.Task]
+    big: bool
+    controller: "ThroughputController"
+    on_sent: Optional[Callable[[int], None]]
+    depth: int
+    in_flight: Deque[asyncio.Task]
     loop: asyncio.AbstractEventLoop
+    dc_id: int
 
     def __init__(
         self,
@@ -115,44 +172,481 @@ class UploadSender:
         file_id: int,
         part_count: int,
         big: bool,
-        index: int,
-        stride: int,
-        loop: asyncio.AbstractEventLoop
+        controller: "ThroughputController",
+        loop: asyncio.AbstractEventLoop,
+        on_sent: Optional[Callable[[int], None]] = None,
+        depth: int = 1,
+        dc_id: int = 0
     ) -> None:
 
         self.client = client
         self.sender = sender
+        self.file_id = file_id
         self.part_count = part_count
-        if big:
-            self.request = SaveBigFilePartRequest(
-                file_id, index, part_count, b""
+        self.big = big
+        self.controller = controller
+        self.on_sent = on_sent
+        self.depth = depth
+        self.in_flight = deque()
+        self.loop = loop
+        self.dc_id = dc_id
+
+    async def next(self, part: int, data: bytes) -> None:
+        # Up to `depth` parts wait for their answer on this connection
+        if len(self.in_flight) >= self.depth:
+            await self.in_flight.popleft()
+        self.in_flight.append(self.loop.create_task(self._next(part, data)))
+
+    async def _next(self, part: int, data: bytes) -> None:
+        if self.big:
+            request = SaveBigFilePartRequest(
+                self.file_id, part, self.part_count, data
             )
         else:
-            self.request = SaveFilePartRequest(
-                file_id, index, b""
+            request = SaveFilePartRequest(
+                self.file_id, part, data
             )
-        self.stride = stride
-        self.previous = None
-        self.loop = loop
-
-    async def next(self, data: bytes) -> None:
-        if self.previous:
-            await self.previous
-        self.previous = self.loop.create_task(self._next(data))
 
-    async def _next(self, data: bytes) -> None:
-        self.request.bytes = data
         log.debug(
-            f"Sending file part {self.request.file_part}/{self.part_count}"
+            f"Sending file part {part}/{self.part_count}"
             f" with {len(data)} bytes"
         )
-        await self.client._call(self.sender, self.request)
-        self.request.file_part += self.stride
+        await _send_part(
+            self.client,
+            self.sender,
+            request,
+            self.controller,
+            len(data),
+            dc_id=self.dc_id
+        )
+
+        if self.on_sent:
+            self.on_sent(part)
+
+    async def finish(self) -> None:
+        # Every part gets its answer, even after one of them failed
+        results = await asyncio.gather(
+            *self.in_flight, return_exceptions=True
+        )
+        self.in_flight.clear()
+        for result in results:
+            if isinstance(result, BaseException):
+                raise result
+
+
+class ConnectionBudget:
+    """
+    How many connections each DC still has for new transfers. Telegram
+    limits the connections of an account, so every concurrent transfer
+    borrows from the same budget and gives back when it finishes.
+
+    A new transfer gets a fair share of what is free, and transfers
+    holding more than their share hand connections back while other
+    transfers are waiting for one.
+    """
+    max_connections: int
+    in_use: DefaultDict[int, int]
+    transfers: DefaultDict[int, int]
+    waiting: DefaultDict[int, int]
+    changed: asyncio.Condition
+
+    def __init__(self, max_connections: int = 20) -> None:
+        self.max_connections = max_connections
+        self.in_use = defaultdict(int)
+        self.transfers = defaultdict(int)
+        self.waiting = defaultdict(int)
+        self.changed = asyncio.Condition()
+
+    def free(self, dc_id: int) -> int:
+        return self.max_connections - self.in_use[dc_id]
+
+    def fair_share(self, dc_id: int) -> int:
+        sharing = self.transfers[dc_id] + self.waiting[dc_id]
+        return math.ceil(self.max_connections / max(sharing, 1))
+
+    async def borrow(self, *wanted: Tuple[int, int]) -> List[int]:
+        """
+        Takes (dc_id, connections) pairs, one for each transfer, and
+        borrows for all of them at once. A relay needs both of its sides
+        running, holding one while waiting for the other could leave
+        every relay stuck with half of what it needs.
+        Returns how many connections each transfer got, at least one.
+        """
+        dc_ids = [dc_id for dc_id, _ in wanted]
+
+        async with self.changed:
+            for dc_id in dc_ids:
+                self.waiting[dc_id] += 1
+
+            try:
+                await self.changed.wait_for(
+                    lambda: all(
+                        self.free(dc_id) >= dc_ids.count(dc_id)
+                        for dc_id in dc_ids
+                    )
+                )
+            finally:
+                for dc_id in dc_ids:
+                    self.waiting[dc_id] -= 1
+
+            granted = []
+            for index, (dc_id, count) in enumerate(wanted):
+                # Leave one for the other transfers of this borrow
+                others = dc_ids[index + 1:].count(dc_id)
+                share = math.ceil(
+                    self.max_connections / (self.transfers[dc_id] + 1)
+                )
+                count = max(
+                    1, min(count, share, self.free(dc_id) - others)
+                )
+
+                self.in_use[dc_id] += count
+                self.transfers[dc_id] += 1
+                granted.append(count)
+
+            return granted
+
+    async def give_back(
+        self, dc_id: int, count: int, finished: bool = True
+    ) -> None:
+        async with self.changed:
+            self.in_use[dc_id] -= count
+            if finished:
+                self.transfers[dc_id] -= 1
+            self.changed.notify_all()
+
+    def try_borrow(self, dc_id: int, held: int) -> bool:
+        # Growing a running transfer must never make another one wait
+        if (
+            self.waiting[dc_id] or
+            self.free(dc_id) <= 0 or
+            held >= self.fair_share(dc_id)
+        ):
+            return False
+
+        self.in_use[dc_id] += 1
+        return True
+
+    def should_yield(self, dc_id: int, held: int) -> bool:
+        if not self.waiting[dc_id] or held <= 1:
+            return False
+        return held > self.fair_share(dc_id)
+
+
+class ThroughputController:
+    """
+    Measures a running transfer and tells it when to use more or fewer
+    connections. It adds one connection at a time while the throughput
+    keeps going up, takes the last one back once it stops paying off,
+    and halves the connections when telegram asks us to slow down.
+    After a while without floods it starts looking for more again.
+    """
+    interval: float = 2.0
+    probe_after: int = 5
+
+    def __init__(self) -> None:
+        self.last_check = time.monotonic()
+        self.window_bytes = 0
+        self.window_floods = 0
+        self.last_rate = 0.0
+        self.grew = False
+        self.settled = False
+        self.quiet = 0
+
+        self.checks = 0
+        self.parts = 0
+        self.part_time = 0.0
+        self.floods = 0
+
+    @property
+    def latency(self) -> float:
+        return self.part_time / self.parts if self.parts else 0.0
+
+    def part_done(self, size: int, elapsed: float) -> None:
+        self.window_bytes += size
+        self.parts += 1
+        self.part_time += elapsed
+
+    def flood(self) -> None:
+        self.window_floods += 1
+        self.floods += 1
+
+    def grown(self) -> None:
+        self.grew = True
+
+    def grow_failed(self) -> None:
+        # The connection couldn't be opened, try again only after a while
+        self.settled = True
+        self.quiet = 0
+
+    def adjust(self, connections: int) -> int:
+        """
+        Returns how many connections to add, or to remove when negative.
+        """
+        now = time.monotonic()
+        elapsed = now - self.last_check
+        if elapsed < self.interval:
+            return 0
+
+        rate = self.window_bytes / elapsed
+        floods, grew = self.window_floods, self.grew
+
+        self.last_check = now
+        self.window_bytes = 0
+        self.window_floods = 0
+        self.grew = False
+        self.checks += 1
+
+        log.debug(
+            f"{rate / connections / 1024:.0f} KB/s per connection"
+            f" with {connections} connections, {floods} floods"
+        )
+
+        if floods:
+            self.settled = True
+            self.quiet = 0
+            self.last_rate = rate
+            return max(1, connections // 2) - connections
+
+        self.quiet += 1
+        if self.settled and self.quiet >= self.probe_after:
+            self.settled = False
+
+        if grew and rate < self.last_rate * 1.05:
+            # The last connection didn't make it any faster
+            self.settled = True
+            self.last_rate = rate
+            return -1
+
+        self.last_rate = rate
+        if not self.settled:
+            return 1
+        return 0
+
+
+class TransferTuner:
+    """
+    Remembers, for each DC, the connection count transfers settled on
+    and the part size that suited it, so the next transfer starts from
+    there instead of a fixed guess.
+    """
+    part_sizes: Tuple[int, ...] = (
+        64 * 1024, 128 * 1024, 256 * 1024, 512 * 1024
+    )
+
+    # Telegram accepts up to 4000 parts for a file
+    max_parts: int = 3000
+
+    connections: Dict[int, int]
+    part_size: Dict[int, int]
+
+    # Requests each connection keeps waiting for an answer at once
+    pipeline_depth: int
+
+    def __init__(self, pipeline_depth: int = 2) -> None:
+        self.connections = {}
+        self.part_size = {}
+        self.pipeline_depth = pipeline_depth
+
+    def connection_count(self, dc_id: int, file_size: int) -> int:
+        # Pipelined connections each do the work of several
+        by_size = math.ceil(
+            ParallelTransferrer._get_connection_count(file_size) /
+            self.pipeline_depth
+        )
+        if dc_id in self.connections:
+            return min(by_size, self.connections[dc_id])
+        return by_size
+
+    def part_size_for(self, dc_id: int, file_size: int) -> int:
+        part_size = self.part_size.get(
+            dc_id, utils.get_appropriated_part_size(file_size) * 1024
+        )
+
+        for size in self.part_sizes:
+            if (
+                size >= part_size and
+                math.ceil(file_size / size) <= self.max_parts
+            ):
+                return size
+        return self.part_sizes[-1]
+
+    def record(
+        self,
+        dc_id: int,
+        connections: int,
+        part_size: int,
+        controller: ThroughputController
+    ) -> None:
+
+        # Short transfers never got to try other connection counts
+        if controller.checks >= 2:
+            self.connections[dc_id] = connections
+
+        if part_size not in self.part_sizes or not controller.parts:
+            return
+
+        # Floods count requests, bigger parts need fewer of them. Slow
+        # parts are the first to time out, quick ones spend more time
+        # in round trips than in the transfer itself
+        index = self.part_sizes.index(part_size)
+        if controller.latency > 3:
+            index = max(index - 1, 0)
+        elif controller.floods or controller.latency < 1:
+            index = min(index + 1, len(self.part_sizes) - 1)
+
+        self.part_size[dc_id] = self.part_sizes[index]
+
+
+class SenderPool:
+    """
+    Authorized connections kept open between transfers, one pool per
+    client and shared by all its ParallelTransferrers.
+
+    The authorization for a foreign DC is exported only once, every
+    other connection to that DC reuses the same auth key. Connections
+    idle for longer than `idle_timeout` seconds are closed, the ones that
+    dropped while idle are thrown away instead of handed out.
+    """
+    client: TelegramClient
+    budget: ConnectionBudget
+    tuner: TransferTuner
+    idle_timeout: float
+    auth_keys: Dict[int, AuthKey]
+    idle: DefaultDict[int, List[Tuple[MTProtoSender, float]]]
+    auth_locks: DefaultDict[int, asyncio.Lock]
+    reaper: Optional[asyncio.Task]
+
+    def __init__(
+        self, client: TelegramClient, idle_timeout: float = 60
+    ) -> None:
+        self.client = client
+        self.budget = ConnectionBudget()
+        self.tuner = TransferTuner()
+        self.idle_timeout = idle_timeout
+        self.auth_keys = {}
+        self.idle = defaultdict(list)
+        self.auth_locks = defaultdict(asyncio.Lock)
+        self.reaper = None
+
+    async def acquire(self, dc_id: int) -> MTProtoSender:
+        idle = self.idle[dc_id]
+        while idle:
+            sender, _ = idle.pop()
+            if sender.is_connected():
+                return sender
+
+        return await self._connect(dc_id)
+
+    def release(self, dc_id: int, sender: MTProtoSender) -> None:
+        # A broken connection is not worth keeping
+        if not sender.is_connected():
+            return
+
+        self.idle[dc_id].append((sender, time.monotonic()))
+
+        if not self.reaper:
+            self.reaper = self.client.loop.create_task(self._evict_idle())
+
+    async def close(self) -> None:
+        if self.reaper:
+            self.reaper.cancel()
+            self.reaper = None
+
+        senders = [
+            sender for idle in self.idle.values() for sender, _ in idle
+        ]
+        self.idle.clear()
+        await asyncio.gather(*[sender.disconnect() for sender in senders])
+
+    async def _evict_idle(self) -> None:
+        while True:
+            await asyncio.sleep(self.idle_timeout / 2)
+
+            now = time.monotonic()
+            expired = []
+            for idle in self.idle.values():
+                expired.extend(
+                    sender for sender, released in idle
+                    if now - released > self.idle_timeout
+                    or not sender.is_connected()
+                )
+                idle[:] = [
+                    (sender, released) for sender, released in idle
+                    if now - released <= self.idle_timeout
+                    and sender.is_connected()
+                ]
+
+            if expired:
+                log.debug(f"Closing {len(expired)} idle connections")
+                await asyncio.gather(
+                    *[sender.disconnect() for sender in expired]
+                )
+
+    async def _connect(self, dc_id: int) -> MTProtoSender:
+        if dc_id == self.client.session.dc_id:
+            return await self._open(dc_id, self.client.session.auth_key)
+
+        # Only the first connection to a foreign DC exports the
+        # authorization, the others wait for its auth key
+        async with self.auth_locks[dc_id]:
+            if dc_id in self.auth_keys:
+                return await self._open(dc_id, self.auth_keys[dc_id])
+
+            sender = await self._open(dc_id, None)
+
+            log.debug(f"Exporting auth to DC {dc_id}")
+
+            auth = await self.client(
+                ExportAuthorizationRequest(dc_id)
+            )
+            self.client._init_request.query = ImportAuthorizationRequest(
+                id=auth.id,
+                bytes=auth.bytes
+            )
+
+            req = InvokeWithLayerRequest(
+                LAYER, self.client._init_request
+            )
+
+            await sender.send(req)
+            self.auth_keys[dc_id] = sender.auth_key
+            return sender
+
+    async def _open(
+        self, dc_id: int, auth_key: Optional[AuthKey]
+    ) -> MTProtoSender:
+        dc = await self.client._get_dc(dc_id)
+
+        sender = MTProtoSender(
+            auth_key,
+            loggers=self.client._log
+        )
+        await sender.connect(
+            self.client._connection(
+                dc.ip_address, dc.port, dc.id,
+                loggers=self.client._log,
+                proxy=self.client._proxy
+            )
+        )
+        return sender
+
+
+sender_pools: "WeakKeyDictionary[TelegramClient, SenderPool]" = (
+    WeakKeyDictionary()
+)
 
-    async def disconnect(self) -> None:
-        if self.previous:
-            await self.previous
-        return await self.sender.disconnect()
+
+def get_sender_pool(client: TelegramClient) -> SenderPool:
+    if client not in sender_pools:
+        sender_pools[client] = SenderPool(client)
+    return sender_pools[client]
+
+
+async def close_sender_pool(client: TelegramClient) -> None:
+    pool = sender_pools.pop(client, None)
+    if pool:
+        await pool.close()
 
 
 class ParallelTransferrer:
@@ -160,8 +654,17 @@ class ParallelTransferrer:
     loop: asyncio.AbstractEventLoop
     dc_id: int
     senders: Optional[List[Union[DownloadSender, UploadSender]]]
-    auth_key: AuthKey
+    pool: SenderPool
+    budget: ConnectionBudget
+    tuner: TransferTuner
+    controller: ThroughputController
+    add_sender: Optional[Callable[[], Awaitable[None]]]
+    on_part_sent: Optional[Callable[[int], None]]
+    part_size: int
+    borrowed: int
+    retiring: int
     upload_ticker: int
+    upload_part: int
 
     def __init__(
         self, client: TelegramClient, dc_id: Optional[int] = None
@@ -169,21 +672,95 @@ class ParallelTransferrer:
         self.client = client
         self.loop = self.client.loop
         self.dc_id = dc_id or self.client.session.dc_id
-
-        if dc_id and self.client.session.dc_id != dc_id:
-            self.auth_key = None
-        else:
-            self.auth_key = self.client.session.auth_key
+        self.pool = get_sender_pool(client)
+        self.budget = self.pool.budget
+        self.tuner = self.pool.tuner
+        self.controller = ThroughputController()
 
         self.senders = None
+        self.add_sender = None
+        self.on_part_sent = None
+        self.part_size = 0
+        self.borrowed = 0
+        self.retiring = 0
         self.upload_ticker = 0
+        self.upload_part = 0
+
+    async def _borrow(self, wanted: int) -> int:
+        # A relay borrows for both of its sides beforehand
+        if not self.borrowed:
+            [self.borrowed] = await self.budget.borrow((self.dc_id, wanted))
+        return self.borrowed
+
+    async def _give_back(self) -> None:
+        if self.borrowed:
+            borrowed, self.borrowed = self.borrowed, 0
+            await self.budget.give_back(self.dc_id, borrowed)
+
+    def _should_retire(self) -> bool:
+        if len(self.senders) <= 1:
+            return False
+        return (
+            self.retiring > 0 or
+            self.budget.should_yield(self.dc_id, len(self.senders))
+        )
+
+    async def _retire(
+        self, sender: Union[DownloadSender, UploadSender]
+    ) -> None:
+        # Fewer connections were faster, or another transfer needs it
+        self.retiring = max(self.retiring - 1, 0)
+        self.senders.remove(sender)
+        try:
+            await sender.finish()
+        finally:
+            self.pool.release(self.dc_id, sender.sender)
+            await self.budget.give_back(self.dc_id, 1, finished=False)
+            self.borrowed -= 1
+
+    async def _adapt(self) -> None:
+        change = self.controller.adjust(len(self.senders))
+
+        if change < 0:
+            self.retiring = -change
+
+        elif change > 0 and self.budget.try_borrow(
+            self.dc_id, len(self.senders)
+        ):
+            self.borrowed += 1
+            try:
+                await self.add_sender()
+            except Exception as e:
+                # The transfer goes on with the connections it has
+                log.warning(
+                    f"Couldn't add a connection to DC {self.dc_id}: {e}"
+                )
+                await self.budget.give_back(self.dc_id, 1, finished=False)
+                self.borrowed -= 1
+                self.controller.grow_failed()
+                return
+            self.controller.grown()
 
     async def _cleanup(self) -> None:
-        await asyncio.gather(
-            *[sender.disconnect() for sender in self.senders]
-        )
+        # Wait for the parts still on the way, then keep the
+        # connections open in the pool for the next transfer
+        senders = self.senders or []
         self.senders = None
 
+        if senders:
+            self.tuner.record(
+                self.dc_id, len(senders), self.part_size, self.controller
+            )
+
+        try:
+            await asyncio.gather(
+                *[sender.finish() for sender in senders]
+            )
+        finally:
+            for sender in senders:
+                self.pool.release(self.dc_id, sender.sender)
+            await self._give_back()
+
     @staticmethod
     def _get_connection_count(
         file_size: int,
@@ -199,59 +776,32 @@ class ParallelTransferrer:
         self,
         connections: int,
         file: TypeLocation,
-        part_count: int,
         part_size: int
     ) -> None:
 
-        minimum, remainder = divmod(part_count, connections)
-
-        def get_part_count() -> int:
-            nonlocal remainder
-            if remainder > 0:
-                remainder -= 1
-                return minimum + 1
-            return minimum
+        self.file = file
+        self.part_size = part_size
 
         # The first cross-DC sender will export+import the authorization, so we always create it
         # before creating any other senders.
         self.senders = [
-            await self._create_download_sender(
-                file, 
-                0, 
-                part_size,
-                connections * part_size,
-                get_part_count()
-            ),
+            await self._create_download_sender(),
             *await asyncio.gather(
-                *[self._create_download_sender(
-                    file,
-                    i,
-                    part_size,
-                    connections * part_size,
-                    get_part_count()
-                )
-                  for i in range(1, connections)
+                *[self._create_download_sender()
+                  for _ in range(1, connections)
                 ]
             )
         ]
 
-    async def _create_download_sender(
-        self, 
-        file: TypeLocation,
-        index: int,
-        part_size: int,
-        stride: int,
-        part_count: int
-    ) -> DownloadSender:
+    async def _create_download_sender(self) -> DownloadSender:
 
         return DownloadSender(
             self.client, 
             await self._create_sender(),
-            file, 
-            index * part_size,
-            part_size,
-            stride, 
-            part_count
+            self.file, 
+            self.part_size,
+            self.controller,
+            dc_id=self.dc_id
         )
 
     async def _init_upload(
@@ -262,72 +812,36 @@ class ParallelTransferrer:
         big: bool
     ) -> None:
 
+        self.file_id = file_id
+        self.part_count = part_count
+        self.big = big
+
         self.senders = [
-            await self._create_upload_sender(
-                file_id, part_count, big, 0, connections
-            ),
+            await self._create_upload_sender(),
             *await asyncio.gather(
-                *[self._create_upload_sender(
-                    file_id, part_count, big, i, connections
-                )
-                  for i in range(1, connections)
+                *[self._create_upload_sender()
+                  for _ in range(1, connections)
                 ]
             )
         ]
 
-    async def _create_upload_sender(
-        self,
-        file_id: int,
-        part_count: int,
-        big: bool,
-        index: int,
-        stride: int
-    ) -> UploadSender:
+    async def _create_upload_sender(self) -> UploadSender:
 
         return UploadSender(
             self.client,
             await self._create_sender(),
-            file_id,
-            part_count,
-            big,
-            index,
-            stride,
-            loop=self.loop
+            self.file_id,
+            self.part_count,
+            self.big,
+            self.controller,
+            loop=self.loop,
+            on_sent=self.on_part_sent,
+            depth=self.tuner.pipeline_depth,
+            dc_id=self.dc_id
         )
 
     async def _create_sender(self) -> MTProtoSender:
-        dc = await self.client._get_dc(self.dc_id)
-
-        sender = MTProtoSender(
-            self.auth_key,
-            loggers=self.client._log
-        )
-        await sender.connect(
-            self.client._connection(
-                dc.ip_address, dc.port, dc.id,
-                loggers=self.client._log,
-                proxy=self.client._proxy
-            )
-        )
-
-        if not self.auth_key:
-            log.debug(f"Exporting auth to DC {self.dc_id}")
-
-            auth = await self.client(
-                ExportAuthorizationRequest(self.dc_id)
-            )
-            self.client._init_request.query = ImportAuthorizationRequest(
-                id=auth.id,
-                bytes=auth.bytes
-            )
-
-            req = InvokeWithLayerRequest(
-                LAYER, self.client._init_request
-            )
-
-            await sender.send(req)
-            self.auth_key = sender.auth_key
-        return sender
+        return await self.pool.acquire(self.dc_id)
 
     async def init_upload(
         self,
@@ -337,97 +851,252 @@ class ParallelTransferrer:
         connection_count: Optional[int] = None
     ) -> Tuple[int, int, bool]:
 
-        connection_count = (
-                connection_count or 
-                self._get_connection_count(file_size)
+        connection_count = await self._borrow(
+            connection_count or
+            self.tuner.connection_count(self.dc_id, file_size)
         )
 
         part_size = (
             part_size_kb or
-            utils.get_appropriated_part_size(file_size) * 1024
+            self.tuner.part_size_for(self.dc_id, file_size)
         )
 
         part_count = (file_size + part_size - 1) // part_size
         is_large = file_size > 10 * 1024 * 1024
 
-        await self._init_upload(
-            connection_count, file_id, part_count, is_large
-        )
+        self.part_size = part_size
+        self.add_sender = self._add_upload_sender
+
+        try:
+            await self._init_upload(
+                connection_count, file_id, part_count, is_large
+            )
+        except BaseException:
+            await self._cleanup()
+            raise
 
         return (part_size, part_count, is_large)
 
+    async def _add_upload_sender(self) -> None:
+        self.senders.append(await self._create_upload_sender())
+
+    def skip_upload(self) -> None:
+        # Telegram already has this part from an earlier attempt
+        self.upload_part += 1
+
     async def upload(self, part: bytes) -> None:
-        await self.senders[self.upload_ticker].next(part)
+        await self._adapt()
+
+        self.upload_ticker %= len(self.senders)
+        sender = self.senders[self.upload_ticker]
+
+        if self._should_retire():
+            await self._retire(sender)
+            self.upload_ticker %= len(self.senders)
+            sender = self.senders[self.upload_ticker]
+
+        await sender.next(self.upload_part, part)
+        self.upload_part += 1
         self.upload_ticker = (self.upload_ticker + 1) % len(self.senders)
 
     async def finish_upload(self) -> None:
         await self._cleanup()
 
-    async def download(
+    def _start_fetching(self, sender: DownloadSender) -> None:
+        # Several requests in flight on the same connection
+        for _ in range(self.tuner.pipeline_depth):
+            self.workers.append(
+                self.loop.create_task(self._fetch_parts(sender))
+            )
+
+    async def _fetch_parts(self, sender: DownloadSender) -> None:
+        while True:
+            await self.slots.acquire()
+
+            # Nothing left, or the connection was retired by
+            # another request running on it
+            if not self.missing or sender not in self.senders:
+                self.slots.release()
+                return
+
+            part = self.missing.popleft()
+            try:
+                data = await sender.next(part)
+            except Exception as e:
+                await self.arrived.put((part, e))
+                return
+            await self.arrived.put((part, data))
+
+            await self._adapt()
+            if sender in self.senders and self._should_retire():
+                await self._retire(sender)
+                return
+
+    async def _add_download_sender(self) -> None:
+        sender = await self._create_download_sender()
+        self.senders.append(sender)
+        self._start_fetching(sender)
+
+        # The window grows with the connections
+        for _ in range(self.parts_per_connection):
+            self.slots.release()
+
+    async def _download_parts(
         self,
         file: TypeLocation,
         file_size: int,
-        part_size_kb: Optional[float] = None,
-        connection_count: Optional[int] = None
-    ) -> AsyncGenerator[bytes, None]:
-
-        connection_count = (
-            connection_count or 
-            self._get_connection_count(file_size)
+        part_size_kb: Optional[float],
+        connection_count: Optional[int],
+        ordered: bool,
+        skip: Optional[Set[int]] = None
+    ) -> AsyncGenerator[Tuple[int, bytes], None]:
+        """
+        Every connection takes the next missing part as soon as it is free,
+        so a slow connection only delays its own part instead of the round.
+        Parts are yielded with their offset, in the order they arrive or,
+        when `ordered`, in file order. Either way only a few parts per
+        connection can be requested or waiting to be consumed at a time.
+        The parts in `skip` were already downloaded and are not requested.
+        """
+
+        connection_count = await self._borrow(
+            connection_count or
+            self.tuner.connection_count(self.dc_id, file_size)
         )
 
         part_size = (
             part_size_kb or
-            utils.get_appropriated_part_size(file_size) * 1024
+            self.tuner.part_size_for(self.dc_id, file_size)
         )
 
         part_count = math.ceil(file_size / part_size)
+        skip = skip or set()
 
         log.debug(
             "Starting parallel download: "
             f"{connection_count} {part_size} {part_count} {file!s}"
         )
-        await self._init_download(
-            connection_count, file, part_count, part_size
+        try:
+            await self._init_download(connection_count, file, part_size)
+        except BaseException:
+            await self._cleanup()
+            raise
+
+        self.add_sender = self._add_download_sender
+        self.parts_per_connection = max(4, 2 * self.tuner.pipeline_depth)
+        self.missing = deque(
+            part for part in range(part_count) if part not in skip
+        )
+        self.arrived = asyncio.Queue()
+        self.slots = asyncio.Semaphore(
+            connection_count * self.parts_per_connection
         )
+        self.workers = []
+        for sender in self.senders:
+            self._start_fetching(sender)
 
-        part = 0
-        while part < part_count:
-            tasks = []
-            for sender in self.senders:
-                tasks.append(
-                    self.loop.create_task(
-                        sender.next()
-                    )
-                )
+        try:
+            buffered = {}
+            next_part = 0
 
-            for task in tasks:
-                data = await task
-                if not data:
-                    break
-                yield data
-                part += 1
-                log.debug(f"Part {part} downloaded")
+            for _ in range(len(self.missing)):
+                part, data = await self.arrived.get()
+                if isinstance(data, Exception):
+                    raise data
 
-        log.debug("Parallel download finished, cleaning up connections")
-        await self._cleanup()
+                if not ordered:
+                    yield part * part_size, data
+                    self.slots.release()
+                    log.debug(f"Part {part} downloaded")
+                    continue
 
+                # Hold the early parts until the ones before them arrive
+                buffered[part] = data
+                while next_part in buffered:
+                    yield next_part * part_size, buffered.pop(next_part)
+                    self.slots.release()
+                    log.debug(f"Part {next_part} downloaded")
+                    next_part += 1
 
-parallel_transfer_locks: DefaultDict[int, asyncio.Lock] = defaultdict(lambda: asyncio.Lock())
+        finally:
+            for worker in self.workers:
+                worker.cancel()
 
+            log.debug("Parallel download finished, cleaning up connections")
+            await self._cleanup()
+
+
+    async def download(
+        self,
+        file: TypeLocation,
+        file_size: int,
+        part_size_kb: Optional[float] = None,
+        connection_count: Optional[int] = None
+    ) -> AsyncGenerator[bytes, None]:
+
+        async for _, data in self._download_parts(
+            file, file_size, part_size_kb, connection_count, ordered=True
+        ):
+            yield data
+
+    async def download_unordered(
+        self,
+        file: TypeLocation,
+        file_size: int,
+        part_size_kb: Optional[float] = None,
+        connection_count: Optional[int] = None,
+        skip: Optional[Set[int]] = None
+    ) -> AsyncGenerator[Tuple[int, bytes], None]:
+
+        async for offset, data in self._download_parts(
+            file,
+            file_size,
+            part_size_kb,
+            connection_count,
+            ordered=False,
+            skip=skip
+        ):
+            yield offset, data
+
+
+def write_at(out: BinaryIO, offset: int, data: bytes) -> None:
+    # Positional writes don't move the file cursor, windows has no pwrite
+    if hasattr(os, "pwrite"):
+        os.pwrite(out.fileno(), data, offset)
+    else:
+        out.seek(offset)
+        out.write(data)
 
-def stream_file(file_to_stream: BinaryIO, chunk_size=1024):
-    while True:
-        data_read = file_to_stream.read(chunk_size)
-        if not data_read:
-            break
-        yield data_read
+
+def read_parts(
+    file: BinaryIO, part_size: int
+) -> Iterator[memoryview]:
+    """
+    Maps the file in memory and yields it one upload part at a time, as
+    views of the mapping, so nothing is read or copied until it's used.
+    A view is only valid until the next part is requested.
+    """
+    size = os.fstat(file.fileno()).st_size
+
+    # Empty files can't be mapped, and have no parts anyway
+    if not size:
+        return
+
+    with (
+        mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mapped,
+        memoryview(mapped) as view
+    ):
+        for offset in range(0, size, part_size):
+            with view[offset:offset + part_size] as part:
+                yield part
 
 
 async def _internal_transfer_to_telegram(
     client: TelegramClient,
     response: BinaryIO,
-    progress_callback: callable
+    progress_callback: callable,
+    file_name: str = "upload",
+    session: Optional[UploadSession] = None
 ) -> Tuple[TypeInputFile, int]:
 
     file_id = helpers.generate_random_long()
@@ -435,44 +1104,50 @@ async def _internal_transfer_to_telegram(
 
     hash_md5 = hashlib.md5()
     uploader = ParallelTransferrer(client)
-    part_size, part_count, is_large = await uploader.init_upload(
-        file_id, file_size
-    )
-
-    buffer = bytearray()
-
-    for data in stream_file(response):
-        if progress_callback:
-            r = progress_callback(response.tell(), file_size)
-            if inspect.isawaitable(r):
-                await r
-
-        if not is_large:
-            hash_md5.update(data)
+    part_size = uploader.tuner.part_size_for(uploader.dc_id, file_size)
 
-        if len(buffer) == 0 and len(data) == part_size:
-            await uploader.upload(data)
-            continue
-
-        new_len = len(buffer) + len(data)
+    # Parts acknowledged in an earlier attempt are read for the MD5
+    # but not sent again
+    skip = set()
+    if session:
+        skip = session.start(file_id, file_size, part_size, uploader.dc_id)
+        file_id, part_size = session.file_id, session.part_size
+        uploader.on_part_sent = session.add
 
-        if new_len >= part_size:
-            cutoff = part_size - len(buffer)
-            buffer.extend(data[:cutoff])
-            await uploader.upload(bytes(buffer))
-            buffer.clear()
-            buffer.extend(data[cutoff:])
-        else:
-            buffer.extend(data)
+    part_size, part_count, is_large = await uploader.init_upload(
+        file_id, file_size, part_size_kb=part_size
+    )
 
-    if len(buffer) > 0:
-        await uploader.upload(bytes(buffer))
-    await uploader.finish_upload()
+    try:
+        for part, data in enumerate(read_parts(response, part_size)):
+            if not is_large:
+                hash_md5.update(data)
+
+            # Telethon only serializes bytes, this is the only copy
+            # the part goes through
+            if part in skip:
+                uploader.skip_upload()
+            else:
+                await uploader.upload(bytes(data))
+
+            if progress_callback:
+                sent = min((part + 1) * part_size, file_size)
+                r = progress_callback(sent, file_size)
+                if inspect.isawaitable(r):
+                    await r
+
+    finally:
+        # Also gives the connections back if it failed halfway
+        try:
+            await uploader.finish_upload()
+        finally:
+            if session:
+                session.save()
 
     if is_large:
         return (
             InputFileBig(
-                file_id, part_count, "upload"
+                file_id, part_count, file_name
             ),
             file_size
         )
@@ -482,7 +1157,7 @@ async def _internal_transfer_to_telegram(
             InputFile(
                 file_id,
                 part_count,
-                "upload",
+                file_name,
                 hash_md5.hexdigest()
             ), 
             file_size
@@ -493,33 +1168,155 @@ async def download_file(
     client: TelegramClient,
     location: TypeLocation,
     out: BinaryIO,
-    progress_callback: callable = None
+    progress_callback: callable = None,
+    sidecar: Optional[DownloadSidecar] = None
 ) -> BinaryIO:
 
     size = location.size
     dc_id, location = utils.get_input_location(location)
     # We lock the transfers because telegram has connection count limits
     downloader = ParallelTransferrer(client, dc_id)
-    downloaded = downloader.download(location, size)
-    async for x in downloaded:
-        out.write(x)
-        if progress_callback:
-            r = progress_callback(out.tell(), size)
-            if inspect.isawaitable(r):
-                await r
+    part_size = downloader.tuner.part_size_for(dc_id, size)
+
+    # A resumed download keeps the part size it started with. Checking
+    # the parts already written reads most of a big file, in a thread
+    # so the other transfers and jobs keep going meanwhile
+    skip = set()
+    if sidecar:
+        skip = await asyncio.to_thread(sidecar.start, out, part_size)
+        part_size = sidecar.part_size
+
+    # Parts arrive in any order, so the file gets its final size
+    # and each part is written at its own offset
+    out.truncate(size)
+    received = sum(
+        min(part_size, size - part * part_size) for part in skip
+    )
+
+    try:
+        async for offset, data in downloader.download_unordered(
+            location, size, part_size_kb=part_size, skip=skip
+        ):
+            write_at(out, offset, data)
+            received += len(data)
+
+            if sidecar:
+                sidecar.add(offset // part_size, data)
+
+            if progress_callback:
+                r = progress_callback(received, size)
+                if inspect.isawaitable(r):
+                    await r
+
+    finally:
+        if sidecar:
+            sidecar.save()
 
     return out
 
 
+async def relay_file(
+    client: TelegramClient,
+    location: TypeLocation,
+    file_name: str,
+    window: int = 8,
+    progress_callback: callable = None
+) -> TypeInputFile:
+    """
+    Uploads a file while it is downloaded, the parts go straight from one
+    ParallelTransferrer to the other without touching the disk.
+    Only `window` parts wait in memory for the uploader at a time.
+    """
+
+    size = location.size
+    dc_id, location = utils.get_input_location(location)
+
+    file_id = helpers.generate_random_long()
+    uploader = ParallelTransferrer(client)
+    downloader = ParallelTransferrer(client, dc_id)
+
+    tuner = uploader.tuner
+    downloader.borrowed, uploader.borrowed = await uploader.budget.borrow(
+        (downloader.dc_id, tuner.connection_count(downloader.dc_id, size)),
+        (uploader.dc_id, tuner.connection_count(uploader.dc_id, size)),
+    )
+
+    try:
+        part_size, part_count, is_large = await uploader.init_upload(
+            file_id, size
+        )
+    except BaseException:
+        await downloader._give_back()
+        await uploader._cleanup()
+        raise
+
+    # Same part size on both sides, so every downloaded part is
+    # exactly one uploaded part
+    parts: asyncio.Queue = asyncio.Queue(maxsize=window)
+
+    async def relay_parts() -> None:
+        try:
+            async for part in downloader.download(
+                location, size, part_size_kb=part_size
+            ):
+                await parts.put(part)
+        finally:
+            await parts.put(None)
+
+    hash_md5 = hashlib.md5()
+    transferred = 0
+    producer = client.loop.create_task(relay_parts())
+
+    try:
+        while True:
+            part = await parts.get()
+            if part is None:
+                break
+
+            if not is_large:
+                hash_md5.update(part)
+
+            await uploader.upload(part)
+            transferred += len(part)
+
+            if progress_callback:
+                r = progress_callback(transferred, size)
+                if inspect.isawaitable(r):
+                    await r
+
+        # Raises if the download stopped halfway
+        await producer
+        await uploader.finish_upload()
+
+    finally:
+        producer.cancel()
+
+        # Both are already cleaned up unless the relay failed
+        await downloader._give_back()
+        await uploader._cleanup()
+
+    if is_large:
+        return InputFileBig(file_id, part_count, file_name)
+
+    return InputFile(
+        file_id,
+        part_count,
+        file_name,
+        hash_md5.hexdigest()
+    )
+
+
 async def upload_file(
     client: TelegramClient,
     file: BinaryIO,
     progress_callback: callable = None,
+    file_name: str = "upload",
+    session: Optional[UploadSession] = None
 ) -> TypeInputFile:
 
     res = (
         await _internal_transfer_to_telegram(
-            client, file, progress_callback
+            client, file, progress_callback, file_name, session
         )
     )[0]
 
@@ -533,11 +1330,17 @@ async def fast_upload(
     progress_callback: Optional[Callable] = None
 ) -> TypeInputFile:
 
+    # The session is kept after the upload, if sending the message fails
+    # the next attempt reuses the parts. The caller removes it once sent
+    session = UploadSession(file_path)
+
     with open(file_path, "rb") as binary_file:
         uploaded_file_path = await upload_file(
             client=client,
             file=binary_file,
-            progress_callback=progress_callback
+            progress_callback=progress_callback,
+            file_name=file_name or os.path.basename(file_path),
+            session=session
         )
         
         return uploaded_file_path
@@ -550,13 +1353,40 @@ async def fast_download(
 ) -> BinaryIO:
 
     file = message.document
+    sidecar = DownloadSidecar(file_path, file.id, file.size)
+
+    # Keep what a previous attempt already wrote
+    resuming = (
+        os.path.exists(sidecar.path) and os.path.exists(file_path)
+    )
+    mode = "r+b" if resuming else "wb"
                     
-    with open(file_path, "wb") as binary_file:
+    with open(file_path, mode) as binary_file:
         download_path = await download_file(
             client=client, 
             location=file, 
             out=binary_file,
-            progress_callback=progress_callback
+            progress_callback=progress_callback,
+            sidecar=sidecar
         )
 
-        return download_path
+    sidecar.remove()
+    return download_path
+
+
+async def fast_relay(
+    client: TelegramClient,
+    message: Message,
+    window: int = 8,
+    progress_callback: Optional[Callable] = None
+) -> TypeInputFile:
+
+    file = message.document
+
+    return await relay_file(
+        client=client,
+        location=file,
+        file_name=message.file.name or f"{message.id}{message.file.ext}",
+        window=window,
+        progress_callback=progress_callback
+    )
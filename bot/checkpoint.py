@@ -0,0 +1,117 @@
+import sqlite3
+import time
+from typing import Dict, Iterable, Optional, Set, Tuple
+
+from bot.media_index import MediaIndex
+
+# Statuses a message goes through, the last two mean it's done with
+QUEUED = "queued"
+DOWNLOADED = "downloaded"
+FAILED = "failed"
+SENT = "sent"
+SKIPPED = "skipped"
+
+
+class CheckpointStore:
+    """
+    SQLite file recording the status of every message each job has
+    taken, and the id it got in the destiny chat once sent. A job that
+    starts again picks up at the first message it didn't finish and
+    skips the ones after it that were already sent.
+
+    The statuses are kept in memory and written together every few
+    seconds, so a crash can lose only the last ones. The media index
+    shares the same file and commits.
+    """
+
+    def __init__(self, path: str, commit_interval: float = 2) -> None:
+        self.path = path
+        self.commit_interval = commit_interval
+        self.pending: Dict[Tuple[str, int], Tuple[str, Optional[int]]] = {}
+        self.last_commit = time.monotonic()
+
+        self.connection = sqlite3.connect(path)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS messages ("
+            " job TEXT NOT NULL,"
+            " message_id INTEGER NOT NULL,"
+            " status TEXT NOT NULL,"
+            " destiny_id INTEGER,"
+            " updated REAL NOT NULL,"
+            " PRIMARY KEY (job, message_id))"
+        )
+        self.connection.commit()
+
+        self.media = MediaIndex(self.connection)
+
+    def mark(
+        self,
+        job: str,
+        message_ids: Iterable[int],
+        status: str,
+        destiny_ids: Optional[Iterable[Optional[int]]] = None,
+    ) -> None:
+        destiny_ids = list(destiny_ids or [])
+        for index, message_id in enumerate(message_ids):
+            destiny_id = (
+                destiny_ids[index] if index < len(destiny_ids) else None
+            )
+            self.pending[(job, message_id)] = (status, destiny_id)
+
+        if time.monotonic() - self.last_commit >= self.commit_interval:
+            self.commit()
+
+    def commit(self) -> None:
+        if self.pending:
+            now = time.time()
+            # A destiny id already known isn't lost to a later status
+            self.connection.executemany(
+                "INSERT INTO messages VALUES (?, ?, ?, ?, ?)"
+                " ON CONFLICT (job, message_id) DO UPDATE SET"
+                " status = excluded.status,"
+                " destiny_id = COALESCE(excluded.destiny_id, destiny_id),"
+                " updated = excluded.updated",
+                [
+                    (job, message_id, status, destiny_id, now)
+                    for (job, message_id), (status, destiny_id)
+                    in self.pending.items()
+                ],
+            )
+            self.pending.clear()
+
+        self.connection.commit()
+        self.last_commit = time.monotonic()
+
+    def resume(self, job: str) -> Tuple[Optional[int], Set[int]]:
+        """
+        Returns the offset to fetch the job history from, right before
+        the first message that isn't done, and the messages after it
+        that are done already. The offset is None for a new job.
+        """
+        self.commit()
+
+        first_open, last = self.connection.execute(
+            "SELECT"
+            " MIN(CASE WHEN status NOT IN (?, ?) THEN message_id END),"
+            " MAX(message_id)"
+            " FROM messages WHERE job = ?",
+            (SENT, SKIPPED, job),
+        ).fetchone()
+
+        if last is None:
+            return None, set()
+        if first_open is None:
+            return last, set()
+
+        done = self.connection.execute(
+            "SELECT message_id FROM messages"
+            " WHERE job = ? AND message_id > ? AND status IN (?, ?)",
+            (job, first_open, SENT, SKIPPED),
+        ).fetchall()
+        return first_open - 1, {message_id for message_id, in done}
+
+    def close(self) -> None:
+        self.commit()
+        self.connection.close()
@@ -0,0 +1,54 @@
+import configparser
+from pydantic import BaseModel, field_validator
+from typing import Optional
+
+class JobConfig(BaseModel):
+    """
+    One origin to destiny pair to clone, read from a section of the
+    jobs file. The workers and dispatch_ahead cap what a single job can
+    take from the accounts, so a huge channel doesn't starve the rest.
+    """
+
+    name: str
+    origin: int | str
+    destiny: int | str
+    topic_id: Optional[int] = None
+    offset_id: int = 0
+    download_workers: Optional[int] = None
+    dispatch_ahead: Optional[int] = None
+
+    @field_validator("origin", "destiny", mode="before")
+    @classmethod
+    def _chat_id(cls, value):
+        # Ids come as text from the file, usernames stay as they are
+        if isinstance(value, str) and value.lstrip("-").isdigit():
+            return int(value)
+        return value
+
+    @field_validator(
+        "topic_id", "download_workers", "dispatch_ahead", mode="before"
+    )
+    @classmethod
+    def _empty(cls, value):
+        # A key left empty in the file is the same as leaving it out
+        return value or None
+
+
+def load_jobs(jobs_file: str) -> list[JobConfig]:
+    """
+    Reads the jobs file, one section for each job, like:
+
+        [news]
+        origin = -1001697666550
+        destiny = 7924621890
+        offset_id = 120
+
+    Returns an empty list when the file doesn't exist.
+    """
+    config = configparser.ConfigParser()
+    config.read(jobs_file)
+
+    return [
+        JobConfig(name=section, **dict(config.items(section)))
+        for section in config.sections()
+    ]
@@ -0,0 +1,161 @@
+import hashlib
+import os
+import sqlite3
+from typing import Optional
+
+from telethon.tl.types import Document, Message, Photo
+
+
+def message_media(message: Message) -> Document | Photo | None:
+    return message.document or message.photo
+
+
+def file_hash(file_path: str) -> str:
+    # Reads in big chunks, the files can have gigabytes
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as file:
+        while chunk := file.read(1024 * 1024):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class MediaIndex:
+    """
+    Remembers every document that was downloaded or sent, by its id and
+    access hash, and the hash of its content once it's on disk. A repost
+    of the same media, even as a different document, is sent again from
+    the destiny message that already has it, or uploaded from the file
+    already downloaded, without going through telegram twice.
+
+    Destiny messages are kept by account, in private chats and basic
+    groups each account has its own message ids. Where the ids are the
+    same for everyone, like channels, the account is an empty string.
+
+    It lives in the checkpoints database and is written along with it.
+    """
+
+    def __init__(self, connection: sqlite3.Connection) -> None:
+        self.connection = connection
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS media ("
+            " document_id INTEGER NOT NULL,"
+            " access_hash INTEGER NOT NULL,"
+            " content_hash TEXT,"
+            " file_path TEXT,"
+            " PRIMARY KEY (document_id, access_hash))"
+        )
+        self.connection.execute(
+            "CREATE INDEX IF NOT EXISTS media_content"
+            " ON media (content_hash)"
+        )
+
+        # Older databases kept the destiny messages without the account,
+        # those ids may belong to any of them
+        columns = [
+            row[1] for row in
+            self.connection.execute("PRAGMA table_info(media_sent)")
+        ]
+        if columns and "account" not in columns:
+            self.connection.execute("DROP TABLE media_sent")
+
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS media_sent ("
+            " document_id INTEGER NOT NULL,"
+            " access_hash INTEGER NOT NULL,"
+            " destiny_chat INTEGER NOT NULL,"
+            " account TEXT NOT NULL,"
+            " destiny_id INTEGER NOT NULL,"
+            " PRIMARY KEY (document_id, access_hash, destiny_chat, account))"
+        )
+        self.connection.commit()
+
+    def _same_content(self, media: Document | Photo) -> list[tuple[int, int]]:
+        # The media itself and every other one with the same content
+        return [(media.id, media.access_hash)] + self.connection.execute(
+            "SELECT other.document_id, other.access_hash"
+            " FROM media AS this JOIN media AS other"
+            " ON other.content_hash = this.content_hash"
+            " WHERE this.document_id = ? AND this.access_hash = ?"
+            " AND other.document_id != this.document_id",
+            (media.id, media.access_hash),
+        ).fetchall()
+
+    def file(self, media: Document | Photo) -> Optional[str]:
+        """
+        Returns a file already downloaded with this media, if it's still
+        on disk.
+        """
+        for document_id, access_hash in self._same_content(media):
+            row = self.connection.execute(
+                "SELECT file_path FROM media"
+                " WHERE document_id = ? AND access_hash = ?",
+                (document_id, access_hash),
+            ).fetchone()
+            if row and row[0] and os.path.exists(row[0]):
+                return row[0]
+        return None
+
+    def destiny(
+        self,
+        media: Document | Photo,
+        chat_id: int,
+        account: str,
+    ) -> Optional[int]:
+        """
+        Returns the id of a message in the destiny chat that already
+        has this media, as the account sees it.
+        """
+        for document_id, access_hash in self._same_content(media):
+            row = self.connection.execute(
+                "SELECT destiny_id FROM media_sent"
+                " WHERE document_id = ? AND access_hash = ?"
+                " AND destiny_chat = ? AND account = ?",
+                (document_id, access_hash, chat_id, account),
+            ).fetchone()
+            if row:
+                return row[0]
+        return None
+
+    def add_file(
+        self,
+        media: Document | Photo,
+        file_path: str,
+        content_hash: str,
+    ) -> None:
+        self.connection.execute(
+            "INSERT INTO media VALUES (?, ?, ?, ?)"
+            " ON CONFLICT (document_id, access_hash) DO UPDATE SET"
+            " content_hash = excluded.content_hash,"
+            " file_path = excluded.file_path",
+            (media.id, media.access_hash, content_hash, file_path),
+        )
+
+    def forget_file(self, media: Document | Photo) -> None:
+        # Downloaded again, the file is partial until add_file
+        self.connection.execute(
+            "UPDATE media SET file_path = NULL"
+            " WHERE document_id = ? AND access_hash = ?",
+            (media.id, media.access_hash),
+        )
+
+    def add_sent(
+        self,
+        media: Document | Photo,
+        chat_id: int,
+        account: str,
+        destiny_id: int,
+    ) -> None:
+        self.connection.execute(
+            "INSERT INTO media_sent VALUES (?, ?, ?, ?, ?)"
+            " ON CONFLICT (document_id, access_hash, destiny_chat, account)"
+            " DO UPDATE SET destiny_id = excluded.destiny_id",
+            (media.id, media.access_hash, chat_id, account, destiny_id),
+        )
+
+    def forget_sent(self, chat_id: int, account: str, destiny_id: int) -> None:
+        # The destiny message was deleted, it can't be sent from anymore
+        self.connection.execute(
+            "DELETE FROM media_sent"
+            " WHERE destiny_chat = ? AND account = ? AND destiny_id = ?",
+            (chat_id, account, destiny_id),
+        )
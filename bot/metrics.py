@@ -0,0 +1,193 @@
+import asyncio
+from bisect import bisect_left
+from collections import defaultdict
+from typing import Callable, DefaultDict, Dict, List, Sequence, Tuple
+
+# Everything defined here, in the order it's exposed
+registry: List["Metric"] = []
+
+
+def _labels(names: Sequence[str], values: Tuple) -> str:
+    if not names:
+        return ""
+    pairs = ",".join(
+        f'{name}="{value}"' for name, value in zip(names, values)
+    )
+    return "{" + pairs + "}"
+
+
+class Metric:
+    kind = ""
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.label_names = tuple(labels)
+        registry.append(self)
+
+    def samples(self) -> List[str]:
+        return []
+
+    def render(self) -> str:
+        return "\n".join(
+            [
+                f"# HELP {self.name} {self.help}",
+                f"# TYPE {self.name} {self.kind}",
+                *self.samples(),
+            ]
+        )
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = ()):
+        super().__init__(name, help, labels)
+        self.values: DefaultDict[Tuple, float] = defaultdict(float)
+
+    def inc(self, *labels, amount: float = 1) -> None:
+        self.values[labels] += amount
+
+    def samples(self) -> List[str]:
+        return [
+            f"{self.name}{_labels(self.label_names, labels)} {value}"
+            for labels, value in self.values.items()
+        ]
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        help: str,
+        labels: Sequence[str] = (),
+        buckets: Sequence[float] = (0.1, 0.5, 1, 5, 10, 30, 60),
+    ):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(buckets)
+        self.counts: Dict[Tuple, List[int]] = {}
+        self.sums: DefaultDict[Tuple, float] = defaultdict(float)
+
+    def observe(self, value: float, *labels) -> None:
+        # Only the first bucket it fits is counted here, they are made
+        # cumulative when exposed
+        if labels not in self.counts:
+            self.counts[labels] = [0] * (len(self.buckets) + 1)
+        self.counts[labels][bisect_left(self.buckets, value)] += 1
+        self.sums[labels] += value
+
+    def samples(self) -> List[str]:
+        names = self.label_names + ("le",)
+        lines = []
+        for labels, counts in self.counts.items():
+            total = 0
+            for bound, count in zip(self.buckets + ("+Inf",), counts):
+                total += count
+                lines.append(
+                    f"{self.name}_bucket"
+                    f"{_labels(names, labels + (bound,))} {total}"
+                )
+            lines.append(
+                f"{self.name}_sum{_labels(self.label_names, labels)}"
+                f" {self.sums[labels]}"
+            )
+            lines.append(
+                f"{self.name}_count{_labels(self.label_names, labels)}"
+                f" {total}"
+            )
+        return lines
+
+
+class Gauge(Metric):
+    """
+    Read when the metrics are scraped, from the functions tracked.
+    """
+    kind = "gauge"
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = ()):
+        super().__init__(name, help, labels)
+        self.functions: Dict[Tuple, Callable[[], float]] = {}
+
+    def track(self, function: Callable[[], float], *labels) -> None:
+        self.functions[labels] = function
+
+    def untrack(self, *labels) -> None:
+        self.functions.pop(labels, None)
+
+    def samples(self) -> List[str]:
+        return [
+            f"{self.name}{_labels(self.label_names, labels)} {function()}"
+            for labels, function in self.functions.items()
+        ]
+
+
+messages = Counter(
+    "clonegram_messages_total",
+    "Messages that went through each path.",
+    ["path"],
+)
+transfer_bytes = Counter(
+    "clonegram_transfer_bytes_total",
+    "Bytes of file parts transferred, by direction and DC.",
+    ["direction", "dc"],
+)
+part_seconds = Histogram(
+    "clonegram_part_seconds",
+    "Time for each file part request, by sender and DC.",
+    ["sender", "dc"],
+    buckets=(0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30),
+)
+flood_wait_seconds = Counter(
+    "clonegram_flood_wait_seconds_total",
+    "Seconds telegram asked us to wait, by kind of request.",
+    ["kind"],
+)
+rate_limit_wait = Histogram(
+    "clonegram_rate_limit_wait_seconds",
+    "Time waited for the rate limiter, by kind of request.",
+    ["kind"],
+    buckets=(0.01, 0.1, 0.5, 1, 2, 5, 10, 30, 60),
+)
+queue_depth = Gauge(
+    "clonegram_queue_depth",
+    "Items waiting in each queue of every running job.",
+    ["job", "queue"],
+)
+
+
+def render() -> str:
+    return "\n".join(metric.render() for metric in registry) + "\n"
+
+
+async def _handle(
+    reader: asyncio.StreamReader,
+    writer: asyncio.StreamWriter,
+) -> None:
+    # Whatever is asked, the answer is the metrics
+    try:
+        await reader.readuntil(b"\r\n\r\n")
+        body = render().encode()
+        writer.write(
+            b"HTTP/1.1 200 OK\r\n"
+            b"Content-Type: text/plain; version=0.0.4; charset=utf-8\r\n"
+            b"Content-Length: " + str(len(body)).encode() + b"\r\n"
+            b"Connection: close\r\n\r\n" + body
+        )
+        await writer.drain()
+    except (
+        asyncio.IncompleteReadError,
+        asyncio.LimitOverrunError,
+        ConnectionError,
+    ):
+        pass
+    finally:
+        writer.close()
+
+
+async def serve(host: str, port: int) -> asyncio.AbstractServer:
+    """
+    Serves the metrics in the prometheus text format, on every path.
+    """
+    return await asyncio.start_server(_handle, host, port)
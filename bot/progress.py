@@ -0,0 +1,77 @@
+import asyncio
+import time
+from asyncio import Queue
+from typing import Callable, Dict, List, Optional
+
+
+class ProgressReporter:
+    """
+    One progress line for the whole process, instead of a bar for every
+    file. The transfer callbacks only add to a counter, the line with
+    the speed, the messages sent and the depth of the queues of every
+    stage is printed by a task at a fixed interval.
+    """
+
+    def __init__(self, interval: float = 2) -> None:
+        self.interval = interval
+        self.bytes = 0
+        self.messages = 0
+        self.queues: Dict[str, List[Queue]] = {}
+        self.task: Optional[asyncio.Task] = None
+
+    def transfer(self) -> Callable[[int, int], None]:
+        # Called on every chunk, so it does as little as it can
+        last = 0
+
+        def progress_callback(transferred: int, total: int) -> None:
+            nonlocal last
+            self.bytes += transferred - last
+            last = transferred
+
+        return progress_callback
+
+    def sent(self, messages: int = 1) -> None:
+        self.messages += messages
+
+    def watch(self, stage: str, queue: Queue) -> None:
+        self.queues.setdefault(stage, []).append(queue)
+
+    def unwatch(self, stage: str, queue: Queue) -> None:
+        if queue in self.queues.get(stage, []):
+            self.queues[stage].remove(queue)
+
+    def start(self) -> None:
+        if not self.task or self.task.done():
+            self.task = asyncio.create_task(self._report())
+
+    def stop(self) -> None:
+        if self.task:
+            self.task.cancel()
+
+    async def _report(self) -> None:
+        last_bytes, last_messages = self.bytes, self.messages
+        last_time = time.monotonic()
+
+        while True:
+            await asyncio.sleep(self.interval)
+
+            now = time.monotonic()
+            elapsed = now - last_time
+            speed = (self.bytes - last_bytes) / elapsed / 1024 / 1024
+            rate = (self.messages - last_messages) / elapsed
+            last_bytes, last_messages = self.bytes, self.messages
+            last_time = now
+
+            depths = ", ".join(
+                f"{stage} {sum(queue.qsize() for queue in queues)}"
+                for stage, queues in self.queues.items()
+            )
+            print(
+                f"[progress] {speed:.2f} MB/s, {rate:.1f} messages/s,"
+                f" {self.messages} sent, {self.bytes / 1024 / 1024:.1f} MB"
+                f" transferred | queues: {depths or 'none'}"
+            )
+
+
+# Shared by every job and account of the process
+reporter = ProgressReporter()
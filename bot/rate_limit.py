@@ -1,23 +1,33 @@
 import asyncio
 import time
+from typing import Dict, Hashable, Tuple
+
+from bot import metrics
 
 class TokenBucket:
-    def __init__(self, inicial_tokens: int, max_tokens: int, refill_interval: float):
+    def __init__(self, inicial_tokens: float, max_tokens: float, refill_interval: float):
         self.max_tokens = max_tokens
         self.refill_interval = refill_interval
         self.tokens = inicial_tokens
-        self.last_refill_time = time.time()
+        self.last_refill_time = time.monotonic()
+
+        # Waiters take turns, the first one sleeps while the others queue
+        self.lock = asyncio.Lock()
+
+        # If the last caller had to wait, the rate is what holds it back
+        self.limited = False
 
     def _refill_tokens(self):
-        now = time.time()
+        # Fractions of a token count too, nothing is lost between calls
+        now = time.monotonic()
         elapsed = now - self.last_refill_time
-        refill_tokens = int(elapsed / self.refill_interval)
-        
-        if refill_tokens > 0:
-            self.tokens = min(self.max_tokens, self.tokens + refill_tokens)
-            self.last_refill_time += refill_tokens * self.refill_interval
+        self.tokens = min(
+            self.max_tokens,
+            self.tokens + elapsed / self.refill_interval
+        )
+        self.last_refill_time = now
 
-    def consume(self, tokens: int = 1) -> bool:
+    def consume(self, tokens: float = 1) -> bool:
         self._refill_tokens()
 
         # If we have enough tokens to subtract
@@ -26,23 +36,134 @@ class TokenBucket:
             return True
         return False
 
+    def set_rate(self, max_tokens: float, refill_interval: float) -> None:
+        self._refill_tokens()
+        self.max_tokens = max_tokens
+        self.refill_interval = refill_interval
+        self.tokens = min(self.tokens, max_tokens)
+
+    def pause(self, seconds: float) -> None:
+        # A debt of tokens, nobody gets one before the seconds are over
+        self._refill_tokens()
+        self.tokens = min(self.tokens, 0) - seconds / self.refill_interval
+
+    async def acquire(self, tokens: float = 1) -> float:
+        """
+        Waits until the tokens are available and takes them, sleeping
+        exactly the time the missing tokens take to refill.
+        Returns the seconds it waited.
+        """
+        async with self.lock:
+            self._refill_tokens()
+
+            # More than max_tokens at once leaves a debt for the next one
+            needed = min(tokens, self.max_tokens)
+
+            wait = 0.0
+            while self.tokens < needed:
+                # Checked again after the sleep, it may have been paused
+                missing = (needed - self.tokens) * self.refill_interval
+                await asyncio.sleep(missing)
+                wait += missing
+                self._refill_tokens()
+
+            self.tokens -= tokens
+            self.limited = wait > 0
+            return wait
+
+
+class RateLimiter:
+    """
+    One bucket for each kind of request and destination chat, so
+    forwards, copies and uploads to a chat don't use each other's
+    tokens, and neither do different chats.
+    Each kind starts at its own rate, in requests per minute.
+
+    The rates adapt to what telegram allows: a FloodWait halves the
+    rate of that bucket and pauses it for the seconds asked, while
+    requests held back only by the limiter raise it slowly again.
+    """
+
+    # Requests per minute added for each minute sent at the full rate
+    increase: float = 1
+
+    # Share of the rate kept after a FloodWait
+    backoff: float = 0.5
+
+    def __init__(
+        self,
+        rates: Dict[str, float],
+        min_rate: float = 1,
+        max_rate: float = 60,
+    ) -> None:
+        self.rates = rates
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.buckets: Dict[Tuple[str, Hashable], TokenBucket] = {}
+
+    def bucket(self, kind: str, chat_id: Hashable = None) -> TokenBucket:
+        key = (kind, chat_id)
+        if key not in self.buckets:
+            rate = self.rates[kind]
+            self.buckets[key] = TokenBucket(
+                inicial_tokens=1,
+                max_tokens=rate,
+                refill_interval=60 / rate,
+            )
+        return self.buckets[key]
+
+    async def acquire(
+        self, kind: str, chat_id: Hashable = None, cost: float = 1
+    ) -> float:
+        wait = await self.bucket(kind, chat_id).acquire(cost)
+        metrics.rate_limit_wait.observe(wait, kind)
+        if wait:
+            print(f"Preveting flood, waited {wait:.1f} seconds to {kind}")
+        return wait
+
+    def rate(self, kind: str, chat_id: Hashable = None) -> float:
+        return 60 / self.bucket(kind, chat_id).refill_interval
+
+    def _set_rate(self, kind: str, chat_id: Hashable, rate: float) -> None:
+        rate = min(self.max_rate, max(self.min_rate, rate))
+        self.bucket(kind, chat_id).set_rate(
+            max_tokens=rate,
+            refill_interval=60 / rate,
+        )
+
+    def flood(self, kind: str, chat_id: Hashable, seconds: float) -> None:
+        metrics.flood_wait_seconds.inc(kind, amount=seconds)
+        self._set_rate(kind, chat_id, self.rate(kind, chat_id) * self.backoff)
+        self.bucket(kind, chat_id).pause(seconds)
+        print(
+            f"Slowing down {kind} to {self.rate(kind, chat_id):.1f}"
+            " per minute"
+        )
+
+    def success(self, kind: str, chat_id: Hashable = None) -> None:
+        # Going faster only helps when the limiter holds the requests
+        if not self.bucket(kind, chat_id).limited:
+            return
+
+        # A full minute of requests adds the whole increase
+        rate = self.rate(kind, chat_id)
+        if rate < self.max_rate:
+            self._set_rate(kind, chat_id, rate + self.increase / rate)
+
 # Just in case I want to implement tests =)
-async def send_message(bucket: TokenBucket, message: str):
-    while not bucket.consume():
-        print("Rate limit reached. Waiting for tokens...")
-        await asyncio.sleep(1)
+async def send_message(limiter: RateLimiter, message: str):
+    await limiter.acquire("send", "chat")
 
     # Simulate sending the message
     print(f"Message sent: {message}")
 
 async def main():
     # 20 Messages per minute
-    bucket = TokenBucket(inicial_tokens=0, max_tokens=20, refill_interval=3)
+    limiter = RateLimiter({"send": 20})
 
     # Example: Sending 25 messages
     for i in range(25):
-        await send_message(bucket, f"Message {i+1}")
+        await send_message(limiter, f"Message {i+1}")
 
 if __name__ == "__main__":
     asyncio.run(main())
-
@@ -0,0 +1,95 @@
+import asyncio
+from typing import Dict, List, Optional
+
+from bot import metrics
+from telethon import TelegramClient
+from telethon.errors import FloodWaitError
+from telethon.tl.types import Chat, Message
+
+# Ids telegram accepts in a single get_messages request
+MAX_IDS = 100
+
+
+class MessageRefresher:
+    """
+    Fetches again the messages whose file reference expired, so they
+    can be tried again with a fresh one. The ids asked for at about
+    the same time, by every worker of the account, go together in one
+    get_messages request instead of one each.
+
+    Also fetches messages of the destiny chat, to send their media again.
+    """
+
+    def __init__(
+        self,
+        client: TelegramClient,
+        chat: Chat,
+        delay: float = 0.5,
+    ) -> None:
+        self.client = client
+        self.chat = chat
+        self.delay = delay
+        self.pending: Dict[int, asyncio.Future] = {}
+        self.flushing: Optional[asyncio.Task] = None
+
+    async def refresh(
+        self,
+        message: Message | List[Message],
+    ) -> Message | List[Message] | None:
+        """
+        Returns the message again with fresh file references, in the
+        same shape it was given. Deleted messages are left out of a
+        list, and a single one that was deleted comes back as None.
+        """
+        messages = message if isinstance(message, list) else [message]
+        fresh = await self.fetch([item.id for item in messages])
+
+        if isinstance(message, list):
+            return [item for item in fresh if item]
+        return fresh[0]
+
+    async def fetch(self, ids: List[int]) -> List[Optional[Message]]:
+        # None in place of the deleted ones
+        futures = []
+        for id in ids:
+            if id not in self.pending:
+                loop = asyncio.get_running_loop()
+                self.pending[id] = loop.create_future()
+            futures.append(self.pending[id])
+
+        if not self.flushing or self.flushing.done():
+            self.flushing = asyncio.create_task(self._flush())
+
+        return await asyncio.gather(
+            *[asyncio.shield(future) for future in futures]
+        )
+
+    async def _flush(self) -> None:
+        # Gives the other workers a moment to ask for theirs too
+        await asyncio.sleep(self.delay)
+
+        while self.pending:
+            ids = sorted(self.pending)[:MAX_IDS]
+            futures = [self.pending.pop(id) for id in ids]
+
+            try:
+                fresh = await self._get_messages(ids)
+            except Exception as e:
+                for future in futures:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+
+            for future, message in zip(futures, fresh):
+                if not future.done():
+                    future.set_result(message)
+
+    async def _get_messages(self, ids: List[int]) -> List[Optional[Message]]:
+        while True:
+            try:
+                return await self.client.get_messages(self.chat, ids=ids)
+
+            except FloodWaitError as e:
+                metrics.flood_wait_seconds.inc("get_messages", amount=e.seconds)
+                print(f"FloodError detected, it's normal. Waiting {e.seconds} seconds...")
+                await asyncio.sleep(e.seconds)
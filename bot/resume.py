@@ -0,0 +1,182 @@
+import json
+import os
+import time
+import zlib
+from typing import BinaryIO, Dict, Set
+
+
+class DownloadSidecar:
+    """
+    Small file saved next to a partial download, recording which parts
+    are already written and their checksum. A download started again
+    for the same document, even with a refreshed file reference, only
+    fetches the parts that are missing or don't match their checksum.
+    """
+
+    def __init__(
+        self,
+        file_path: str,
+        document_id: int,
+        file_size: int,
+        save_interval: float = 2,
+    ) -> None:
+        self.path = f"{file_path}.parts"
+        self.file_path = file_path
+        self.document_id = document_id
+        self.file_size = file_size
+        self.save_interval = save_interval
+        self.part_size = 0
+        self.parts: Dict[int, int] = {}
+        self.last_save = 0.0
+
+    def load(self) -> None:
+        # Anything that isn't a sidecar of this same document is ignored
+        # and the download starts over
+        try:
+            with open(self.path) as file:
+                state = json.load(file)
+        except (OSError, ValueError):
+            return
+
+        if (
+            state.get("document_id") != self.document_id
+            or state.get("file_size") != self.file_size
+            or not os.path.exists(self.file_path)
+        ):
+            return
+
+        self.part_size = state["part_size"]
+        self.parts = {int(part): crc for part, crc in state["parts"].items()}
+
+    def verify(self, out: BinaryIO) -> Set[int]:
+        """
+        Reads back every recorded part and forgets the ones that were
+        not written completely. Returns the parts that can be skipped.
+        """
+        for part, crc in list(self.parts.items()):
+            out.seek(part * self.part_size)
+            data = out.read(self._part_length(part))
+            if zlib.crc32(data) != crc:
+                del self.parts[part]
+
+        return set(self.parts)
+
+    def start(self, out: BinaryIO, part_size: int) -> Set[int]:
+        self.load()
+        if self.parts:
+            return self.verify(out)
+
+        # Saved before the file gets its size, a file of that size
+        # without a sidecar could pass for a finished download
+        self.part_size = part_size
+        self.parts = {}
+        self.save()
+        return set()
+
+    def add(self, part: int, data: bytes) -> None:
+        self.parts[part] = zlib.crc32(data)
+
+        if time.monotonic() - self.last_save >= self.save_interval:
+            self.save()
+
+    def save(self) -> None:
+        # Written aside and renamed, a crash mid-write can't corrupt it
+        state = {
+            "document_id": self.document_id,
+            "file_size": self.file_size,
+            "part_size": self.part_size,
+            "parts": self.parts,
+        }
+        with open(f"{self.path}.tmp", "w") as file:
+            json.dump(state, file)
+        os.replace(f"{self.path}.tmp", self.path)
+        self.last_save = time.monotonic()
+
+    def remove(self) -> None:
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
+
+    def _part_length(self, part: int) -> int:
+        return min(self.part_size, self.file_size - part * self.part_size)
+
+
+class UploadSession:
+    """
+    Small file saved next to a file being uploaded, recording the
+    file_id of the upload and the parts telegram already acknowledged.
+    Telegram keeps those parts for a while, so an upload retried after
+    a network drop or a restart only sends the ones that are missing.
+    """
+
+    # Telegram forgets parts that were never used after some time
+    max_age: float = 60 * 60
+
+    def __init__(self, file_path: str, save_interval: float = 2) -> None:
+        self.path = f"{file_path}.upload"
+        self.file_path = file_path
+        self.save_interval = save_interval
+        self.file_id = 0
+        self.file_size = 0
+        self.part_size = 0
+        self.dc_id = 0
+        self.parts: Set[int] = set()
+        self.last_save = 0.0
+
+    def start(
+        self, file_id: int, file_size: int, part_size: int, dc_id: int
+    ) -> Set[int]:
+        """
+        Picks up the previous attempt if it uploaded this same file to
+        the same DC recently, otherwise starts a new one with the given
+        file_id and part size. Returns the parts that can be skipped.
+        """
+        try:
+            with open(self.path) as file:
+                state = json.load(file)
+        except (OSError, ValueError):
+            state = {}
+
+        if (
+            state.get("file_size") == file_size
+            and state.get("dc_id") == dc_id
+            and time.time() - state.get("updated", 0) < self.max_age
+        ):
+            self.file_id = state["file_id"]
+            self.part_size = state["part_size"]
+            self.parts = set(state["parts"])
+        else:
+            self.file_id = file_id
+            self.part_size = part_size
+            self.parts = set()
+
+        self.file_size = file_size
+        self.dc_id = dc_id
+        return set(self.parts)
+
+    def add(self, part: int) -> None:
+        self.parts.add(part)
+
+        if time.monotonic() - self.last_save >= self.save_interval:
+            self.save()
+
+    def save(self) -> None:
+        state = {
+            "file_id": self.file_id,
+            "file_size": self.file_size,
+            "part_size": self.part_size,
+            "dc_id": self.dc_id,
+            "parts": sorted(self.parts),
+            "updated": time.time(),
+        }
+        with open(f"{self.path}.tmp", "w") as file:
+            json.dump(state, file)
+        os.replace(f"{self.path}.tmp", self.path)
+        self.last_save = time.monotonic()
+
+    def remove(self) -> None:
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
@@ -0,0 +1,63 @@
+import asyncio
+from collections import OrderedDict, deque
+from typing import Deque
+
+
+class FairScheduler:
+    """
+    Shares a number of slots among the jobs running at once, taking
+    turns between them. A job waiting for a slot gets it before another
+    job takes its next one, so a huge channel with many batches ready
+    can't keep the rest waiting.
+    """
+
+    def __init__(self, slots: int) -> None:
+        self.slots = slots
+        self.used = 0
+
+        # Jobs with something waiting, in the order of their turn
+        self.waiting: OrderedDict[str, Deque[asyncio.Future]] = OrderedDict()
+
+    async def acquire(self, job: str) -> None:
+        if self.used < self.slots and not self.waiting:
+            self.used += 1
+            return
+
+        future = asyncio.get_running_loop().create_future()
+        self.waiting.setdefault(job, deque()).append(future)
+        try:
+            await future
+        except asyncio.CancelledError:
+            # Granted right before it was cancelled, it goes to the next
+            if not future.cancelled():
+                self.release()
+            else:
+                self._forget(job, future)
+            raise
+
+    def release(self) -> None:
+        self.used -= 1
+        self._grant()
+
+    def _grant(self) -> None:
+        while self.used < self.slots and self.waiting:
+            job, futures = self.waiting.popitem(last=False)
+            future = futures.popleft()
+
+            # The job goes to the end of the line
+            if futures:
+                self.waiting[job] = futures
+
+            # Cancelled, its task just didn't get to forget it yet
+            if future.cancelled():
+                continue
+
+            self.used += 1
+            future.set_result(None)
+
+    def _forget(self, job: str, future: asyncio.Future) -> None:
+        futures = self.waiting.get(job)
+        if futures and future in futures:
+            futures.remove(future)
+            if not futures:
+                del self.waiting[job]
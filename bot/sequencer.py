@@ -0,0 +1,45 @@
+import asyncio
+from typing import Dict, Optional, Set
+
+
+class Sequencer:
+    """
+    Keeps things that run at the same time landing in the order they
+    started. Each one gets the next number and waits for its turn
+    before its last step, the turn moves on once every number before
+    it is done, even the ones that failed.
+    """
+
+    def __init__(self) -> None:
+        self.last = 0
+        self.next = 0
+        self.finished: Set[int] = set()
+        self.waiters: Dict[int, asyncio.Future] = {}
+
+    def number(self) -> int:
+        number, self.last = self.last, self.last + 1
+        return number
+
+    async def wait(self, number: Optional[int]) -> None:
+        # Things without a number don't keep any order
+        if number is None or number <= self.next:
+            return
+
+        if number not in self.waiters:
+            loop = asyncio.get_running_loop()
+            self.waiters[number] = loop.create_future()
+        await asyncio.shield(self.waiters[number])
+
+    def done(self, number: Optional[int]) -> None:
+        if number is None or number < self.next:
+            return
+
+        self.finished.add(number)
+        while self.next in self.finished:
+            self.finished.remove(self.next)
+            self.next += 1
+
+        for waiting in [n for n in self.waiters if n <= self.next]:
+            future = self.waiters.pop(waiting)
+            if not future.done():
+                future.set_result(None)
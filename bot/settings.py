@@ -1,6 +1,12 @@
+from pydantic import BaseModel
 from pydantic_settings import BaseSettings
 from typing import Optional
 
+class Account(BaseModel):
+    account_name: str
+    phone_number: str
+    password: Optional[str] = None
+
 class Settings(BaseSettings):
     account_name: str
     phone_number: str
@@ -8,6 +14,92 @@ class Settings(BaseSettings):
     api_id: int
     api_hash: str
 
+    # More sessions sharing the work of each clone, as a JSON list like
+    # ACCOUNTS='[{"account_name": "second", "phone_number": "+55..."}]'
+    # All of them must be members of the origin and destiny chats
+    accounts: list[Account] = []
+
+    # Jobs file with one origin/destiny pair in each section, they all
+    # run at once in this process, sharing the accounts. Without it
+    # main() clones the single pair written there
+    jobs_file: str = "jobs.conf"
+
+    # Batches being sent at once among all the jobs, the jobs take
+    # turns for them so a huge channel can't starve the rest
+    max_dispatching: int = 64
+
+    # What happened to every message of each job, so a job that is
+    # started again goes on from where it stopped. Saved every few
+    # seconds, not on every message
+    checkpoints_file: str = "checkpoints.db"
+    checkpoint_interval: float = 2
+
+    # Batches of messages handed out ahead of the one being sent, they
+    # download and upload meanwhile but are still sent in order
+    dispatch_ahead: int = 16
+
+    # Messages the history prefetcher keeps waiting to be sent, it
+    # fetches again up to the high mark once they drop to the low mark
+    history_high_water: int = 500
+    history_low_water: int = 100
+
+    # Workers downloading protected media in parallel, fed by a bounded
+    # queue so the history fetcher can't run too far ahead of them
+    download_workers: int = 4
+    download_queue_size: int = 8
+
+    # Bytes the downloads can take on disk, a download waits for room
+    # before it starts. Uploaded files stay there for reposts up to the
+    # cache size, the least recently used are removed first
+    spool_budget: int = 10 * 1024 * 1024 * 1024
+    spool_cache_size: int = 1024 * 1024 * 1024
+
+    # Where the metrics are served in the prometheus format, a port
+    # of 0 turns them off
+    metrics_host: str = "127.0.0.1"
+    metrics_port: int = 9464
+
+    # File where the spans of every message are saved, for
+    # python -m bot.tracing to analyze. Empty for no tracing
+    trace_file: Optional[str] = None
+
+    # Seconds between the lines of the progress reporter
+    progress_interval: float = 2
+
+    # Documents bigger than this go through FastTelethon
+    fast_download_min_size: int = 10 * 1024 * 1024
+    fast_upload_min_size: int = 10 * 1024 * 1024
+
+    # Requests per minute to each destination chat, for every kind.
+    # They are only where it starts, every FloodWait slows it down and
+    # it speeds up slowly again, between the min and the max
+    forward_rate_limit: float = 20
+    send_rate_limit: float = 20
+    upload_rate_limit: float = 20
+    min_rate_limit: float = 1
+    max_rate_limit: float = 60
+
+    # Times an upload is tried when the connection drops
+    upload_attempts: int = 3
+
+    # Times a message is fetched again when its file reference expires,
+    # and how long to wait for others to fetch them in the same request
+    refresh_attempts: int = 3
+    refresh_delay: float = 0.5
+
+    # Forwardable messages sent in one request, telegram accepts 100
+    forward_batch_size: int = 100
+
+    # Upload protected documents while downloading them, without saving
+    # them in ./downloads. The window is how many parts wait in memory
+    relay_media: bool = False
+    relay_window: int = 8
+
+    # Connections all the parallel transfers can open to each DC, and
+    # how many part requests each of them keeps in flight
+    max_connections_per_dc: int = 20
+    pipeline_depth: int = 2
+
     class Config:
         env_file = '.env'
         env_file_encoding = 'utf-8'
@@ -0,0 +1,185 @@
+import asyncio
+import os
+from collections import OrderedDict, deque
+from pathlib import Path
+from typing import Awaitable, Callable, Dict, Optional
+
+# Sidecars saved next to a file while it's downloaded or uploaded
+SIDECARS = (".parts", ".upload")
+
+
+class Spool:
+    """
+    Keeps the downloads folder under a budget of bytes. Every download
+    reserves its size first, and waits while there is no room, so the
+    downloads can't run ahead of the uploads and fill the disk.
+
+    Uploaded files aren't needed anymore, they stay as a cache for the
+    reposts up to cache_size and the oldest ones are removed first,
+    also when a download needs their room.
+    """
+
+    def __init__(self, directory: Path, budget: int, cache_size: int = 0):
+        self.directory = directory
+        self.budget = budget
+        self.cache_size = cache_size
+
+        self.size = 0
+        self.reserved = 0
+        self.files: Dict[str, int] = {}
+
+        # Files waiting for upload, by how many messages use them
+        self.users: Dict[str, int] = {}
+
+        # Uploaded files, the least recently used first
+        self.cache: OrderedDict[str, None] = OrderedDict()
+        self.cached_size = 0
+
+        # Downloads waiting for room, in the order they asked for it
+        self.waiting: deque = deque()
+        self.freed = asyncio.Event()
+        self._scan()
+
+    def _scan(self) -> None:
+        # What earlier runs left is cache, the oldest goes first. The
+        # sidecars whose file is gone are of no use anymore, and the
+        # files with one are transfers to resume, not cache. They count
+        # once their download goes on
+        files = []
+        for path in self.directory.rglob("*"):
+            if not path.is_file():
+                continue
+            if path.suffix in SIDECARS:
+                if not path.with_suffix("").exists():
+                    path.unlink()
+                continue
+            if any(
+                Path(f"{path}{end}").exists() for end in SIDECARS
+            ):
+                continue
+            files.append(path)
+
+        for path in sorted(files, key=lambda path: path.stat().st_mtime):
+            self._add(str(path))
+            self._cache(str(path))
+        self._trim(self.cache_size)
+
+    def _add(self, file_path: str) -> None:
+        size = os.path.getsize(file_path)
+        self.files[file_path] = size
+        self.size += size
+
+    def _forget(self, file_path: str) -> None:
+        if file_path in self.cache:
+            del self.cache[file_path]
+            self.cached_size -= self.files[file_path]
+        self.size -= self.files.pop(file_path)
+
+    def _cache(self, file_path: str) -> None:
+        self.cache[file_path] = None
+        self.cached_size += self.files[file_path]
+
+    def _evict(self, file_path: str) -> None:
+        self._forget(file_path)
+        for path in [file_path] + [file_path + end for end in SIDECARS]:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    def _trim(self, cache_size: int) -> None:
+        while self.cache and self.cached_size > cache_size:
+            self._evict(next(iter(self.cache)))
+
+    def _fits(self, size: int) -> bool:
+        # Without the cache it still doesn't fit, the uploads have to
+        # free some room first. Something bigger than the whole budget
+        # goes once nothing else is on its way
+        if self.size - self.cached_size + self.reserved + size > self.budget:
+            if self.reserved or self.users:
+                return False
+
+        self._make_room(size)
+        return True
+
+    def _make_room(self, size: int) -> None:
+        # Room taken from the cache, the oldest files first
+        while self.cache and self.size + self.reserved + size > self.budget:
+            self._evict(next(iter(self.cache)))
+
+    async def reserve(
+        self,
+        size: int,
+        turn: Optional[Callable[[], Awaitable]] = None,
+    ) -> None:
+        """
+        Waits for room for the download, first come, first served. The
+        files of a later download could take all the room while waiting
+        to be uploaded after this one.
+        The files holding the room may be waiting for this download to
+        be sent first, so once its turn comes it goes anyway, over the
+        budget if it must.
+        """
+        ticket = object()
+        self.waiting.append(ticket)
+        turn_arrived = asyncio.ensure_future(turn()) if turn else None
+
+        try:
+            while self.waiting[0] is not ticket or not self._fits(size):
+                if turn_arrived and turn_arrived.done():
+                    self._make_room(size)
+                    break
+
+                self.freed.clear()
+                freed = asyncio.ensure_future(self.freed.wait())
+                try:
+                    await asyncio.wait(
+                        [freed, turn_arrived] if turn_arrived else [freed],
+                        return_when=asyncio.FIRST_COMPLETED,
+                    )
+                finally:
+                    freed.cancel()
+        finally:
+            if turn_arrived:
+                turn_arrived.cancel()
+            self.waiting.remove(ticket)
+            self.freed.set()
+
+        self.reserved += size
+
+    def unreserve(self, size: int) -> None:
+        self.reserved -= size
+        self.freed.set()
+
+    def use(self, file_path: str) -> None:
+        """
+        Marks a file, just downloaded or reused, as waiting for upload.
+        """
+        file_path = str(file_path)
+
+        # It may have grown since it was counted, a partial download
+        if file_path in self.files and file_path not in self.users:
+            self._forget(file_path)
+        if file_path not in self.files:
+            self._add(file_path)
+
+        self.users[file_path] = self.users.get(file_path, 0) + 1
+
+    def release(self, file_path: str) -> None:
+        """
+        The file was uploaded, or failed to be, it goes to the cache.
+        """
+        file_path = str(file_path)
+        if file_path not in self.users:
+            return
+
+        self.users[file_path] -= 1
+        if not self.users[file_path]:
+            del self.users[file_path]
+            if os.path.exists(file_path):
+                self._cache(file_path)
+                self._trim(self.cache_size)
+            else:
+                self._forget(file_path)
+
+        self.freed.set()
@@ -0,0 +1,156 @@
+import asyncio
+import json
+import sys
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, Iterator, List, Optional, Tuple
+
+# Job and message ids the running task is working on, the spans of
+# the requests made for them are recorded under these
+following: ContextVar[Tuple[str, Tuple[int, ...]]] = ContextVar(
+    "following", default=("", ())
+)
+
+
+class Tracer:
+    """
+    Optional record of where the time of every message went. Each
+    stage, from the history fetch to the send, is a span with its
+    start, end and details, saved as a line of JSON. The lines are
+    kept in memory and written by a background task in a thread, so
+    tracing never waits for the disk. Off until a file is opened.
+    """
+
+    def __init__(self, flush_interval: float = 1) -> None:
+        self.path: Optional[str] = None
+        self.flush_interval = flush_interval
+        self.buffer: List[str] = []
+        self.task: Optional[asyncio.Task] = None
+
+    @property
+    def enabled(self) -> bool:
+        return self.path is not None
+
+    def open(self, path: str) -> None:
+        self.path = path
+        self.task = asyncio.create_task(self._flush())
+
+    async def close(self) -> None:
+        if self.task:
+            self.task.cancel()
+        if self.enabled:
+            self._write(self.buffer)
+            self.buffer = []
+
+    def follow(self, job: str, messages) -> None:
+        messages = messages if isinstance(messages, list) else [messages]
+        following.set((job, tuple(message.id for message in messages)))
+
+    def record(self, stage: str, start: float, end: float, **fields) -> None:
+        if not self.enabled:
+            return
+        if "ids" not in fields:
+            fields["job"], fields["ids"] = following.get()
+        self.buffer.append(
+            json.dumps(
+                {"stage": stage, "start": start, "end": end, **fields},
+                default=str,
+            )
+        )
+
+    @contextmanager
+    def span(self, stage: str, **fields) -> Iterator[Dict]:
+        # The fields can still be filled inside, like the ids of a page
+        if not self.enabled:
+            yield fields
+            return
+
+        start = time.time()
+        try:
+            yield fields
+        finally:
+            self.record(stage, start, time.time(), **fields)
+
+    def _write(self, lines: List[str]) -> None:
+        if lines:
+            with open(self.path, "a") as file:
+                file.write("\n".join(lines) + "\n")
+
+    async def _flush(self) -> None:
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            lines, self.buffer = self.buffer, []
+            await asyncio.to_thread(self._write, lines)
+
+
+# Shared by every job and account of the process
+tracer = Tracer()
+
+
+def _percentile(values: List[float], percent: float) -> float:
+    index = min(len(values) - 1, int(len(values) * percent / 100))
+    return sorted(values)[index]
+
+
+def analyze(path: str) -> None:
+    """
+    Prints the percentiles of the time spent in each stage, and the
+    spans of the message that took the longest from fetch to send.
+    """
+    spans = []
+    with open(path) as file:
+        for line in file:
+            if line.strip():
+                spans.append(json.loads(line))
+
+    durations: Dict[str, List[float]] = {}
+    messages: Dict[Tuple[str, int], List[Dict]] = {}
+    for span in spans:
+        durations.setdefault(span["stage"], []).append(
+            span["end"] - span["start"]
+        )
+        for id in span["ids"]:
+            messages.setdefault((span["job"], id), []).append(span)
+
+    print(f"{len(spans)} spans of {len(messages)} messages\n")
+    print(f"{'stage':<16}{'count':>8}{'p50':>10}{'p90':>10}{'p99':>10}{'max':>10}")
+    for stage, values in sorted(durations.items()):
+        print(
+            f"{stage:<16}{len(values):>8}"
+            + "".join(
+                f"{_percentile(values, percent):>10.3f}"
+                for percent in (50, 90, 99, 100)
+            )
+        )
+
+    if not messages:
+        return
+
+    # The message slowest from its first span to its last one
+    (job, id), path_spans = max(
+        messages.items(),
+        key=lambda item: (
+            max(span["end"] for span in item[1]) -
+            min(span["start"] for span in item[1])
+        ),
+    )
+    path_spans.sort(key=lambda span: span["start"])
+    first = path_spans[0]["start"]
+    total = max(span["end"] for span in path_spans) - first
+
+    print(f"\nCritical path, job {job} message_id:{id}, {total:.3f} s")
+    for span in path_spans:
+        details = {
+            key: value for key, value in span.items()
+            if key not in ("stage", "start", "end", "job", "ids")
+        }
+        print(
+            f"  +{span['start'] - first:8.3f} s"
+            f"  {span['stage']:<16}{span['end'] - span['start']:8.3f} s"
+            f"  {details or ''}"
+        )
+
+
+if __name__ == "__main__":
+    analyze(sys.argv[1] if len(sys.argv) > 1 else "trace.jsonl")
@@ -2,40 +2,18 @@ import re
 from unidecode import unidecode
 import filetype
 from asyncio import Queue
-from tqdm import tqdm
+from bot.progress import reporter
 from telethon.tl.types import (
     Message,
     MessageEntityTextUrl,
     MessageEntityUrl,
 )
-import time
-
-
-def create_progress_callback(desc: str = ""):
-    # Speed formula: 
-    # internet speed = receive_bytes / total_bytes
-
-    start_time = time.time()
-    progress_bar = tqdm(
-        total=100,  
-        unit='B',
-        unit_scale=True,
-        desc=desc,
-        leave=True
-    )
-
-    # Retorna a função de callback
-    def wrapped_progress_callback(received_bytes, total_bytes):
-        progress = (received_bytes / total_bytes) * 100
-        progress_bar.n = progress  
-        progress_bar.last_print_n = progress
-        progress_bar.update(0)  
-        # Calculate the download speed to show, 
-        progress_bar.set_postfix({
-            'Speed': f"{(received_bytes / (time.time() - start_time)) / 1024 / 1024:.2f} MB/s"
-        })
-    
-    return wrapped_progress_callback
+
+
+def create_progress_callback():
+    # Every transfer adds to the single progress line of the process,
+    # a bar for each one was unreadable and slow with many at once
+    return reporter.transfer()
 
 def empty_queue(queue: Queue):
   while not queue.empty():
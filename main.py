@@ -1,11 +1,33 @@
-from bot.settings import Settings
-from bot.rate_limit import TokenBucket
-from bot.config import ConfigParser
-from bot.FastTelethon import fast_download, fast_upload
+from bot.settings import Settings, Account
+from bot.rate_limit import RateLimiter
+from bot.resume import UploadSession
+from bot.checkpoint import (
+    CheckpointStore,
+    QUEUED,
+    DOWNLOADED,
+    FAILED,
+    SENT,
+    SKIPPED,
+)
+from bot.sequencer import Sequencer
+from bot.scheduler import FairScheduler
+from bot.refresher import MessageRefresher
+from bot.media_index import message_media, file_hash
+from bot.spool import Spool
+from bot.progress import reporter
+from bot import metrics
+from bot.tracing import tracer
+from bot.jobs import JobConfig, load_jobs
+from bot.FastTelethon import (
+    fast_download,
+    fast_upload,
+    fast_relay,
+    close_sender_pool,
+    get_sender_pool,
+)
 from bot.utils import (
     get_file_name,
     get_file_extension,
-    empty_queue,
     create_progress_callback,
 )
 from telethon import TelegramClient
@@ -14,22 +36,28 @@ from telethon.tl.types import (
     Message,
     User,
     Chat,
+    Channel,
     MessageService,
     KeyboardButtonUrl,
     ReplyInlineMarkup,
     KeyboardButtonRow,
+    InputFile,
+    InputFileBig,
+    TypeInputFile,
 )
 from telethon.errors import (
     FloodWaitError,
     FloodPremiumWaitError,
     FileReferenceExpiredError,
 )    
-from typing import Optional, Callable
+from typing import Optional, Callable, Awaitable, Any
+from functools import partial
 import asyncio
 from pathlib import Path
 from datetime import datetime
 import logging
 import os
+import time
 
 
 logging.basicConfig(
@@ -48,131 +76,197 @@ settings = Settings()
 
 class Bot(TelegramClient):
 
-    def __init__(self):
-        self.messages_queue = asyncio.Queue()
-        self.download_queue = asyncio.Queue()
-        self.finished_queue = False
-        self.finished_dequeue = False
-
-        # Usefull in case of file_id expiration or save to continue later
-        self.last_processed_msg = 0
-
-        # Since rate limit is the amount of messages sended per minute
-        seconds_in_minute = 60
-        self.rate_limit = 20
-        self.interval = seconds_in_minute / self.rate_limit
+    def __init__(
+        self,
+        account: Optional[Account] = None,
+        spool: Optional[Spool] = None,
+    ):
+        # Every account sharing the work of the clones, this one
+        # included. Jobs hand their batches out among them
+        self.shards = [self]
 
-        self.bucket = TokenBucket(
-            inicial_tokens=1,
-            max_tokens=self.rate_limit,
-            refill_interval=self.interval
+        # Since rate limit is the amount of messages sended per minute,
+        # for each kind of request and destination chat
+        self.limiter = RateLimiter(
+            rates={
+                "forward": settings.forward_rate_limit,
+                "send": settings.send_rate_limit,
+                "upload": settings.upload_rate_limit,
+            },
+            min_rate=settings.min_rate_limit,
+            max_rate=settings.max_rate_limit,
         )
-        
+
         # Define the download directory
         self.download_dir = Path('./downloads')
         self.download_dir.mkdir(exist_ok=True)
 
+        # Keeps the downloads under the disk budget, one for the whole
+        # folder, the other accounts get the one of the first
+        self.spool = spool or Spool(
+            self.download_dir,
+            settings.spool_budget,
+            settings.spool_cache_size,
+        )
+
+        # Also the name of its session file
+        self.account_name = (account or settings).account_name
+
         # Get API keys at https://my.telegram.org/auth
         super().__init__(
-            session=settings.account_name,
+            session=self.account_name,
             api_id=settings.api_id,
             api_hash=settings.api_hash,
-            flood_sleep_threshold=11
+            # Every FloodWait has to reach the rate limiter, so it
+            # learns the rate telegram allows. The requests outside of
+            # it go through _retry_floods instead
+            flood_sleep_threshold=0
         )
-    
+
+        # Shared by all the downloads and uploads running at once
+        sender_pool = get_sender_pool(self)
+        sender_pool.budget.max_connections = settings.max_connections_per_dc
+        sender_pool.tuner.pipeline_depth = settings.pipeline_depth
+
     async def get_last_message(self, origin_chat):
-        async for message in self.iter_messages(entity=origin_chat, limit=1):
+        messages = await self._retry_floods(
+            "history", self.get_messages, entity=origin_chat, limit=1
+        )
+        for message in messages:
             print("Total messages in the group", message.id)
             return message.id
 
+    async def _retry_floods(
+        self,
+        kind: str,
+        request: Callable[..., Awaitable],
+        **kwargs,
+    ) -> Any:
+        """
+        Sends the request again after every FloodWait, once the wait is
+        over. Telethon doesn't sleep on them anymore, so every request
+        that doesn't go through the rate limiter needs it.
+        """
 
-    async def _get_chat_messages(
-        self, 
-        origin_chat: Chat,
-        offset_id: int = 0,
-        limit: int = 100,
-        reverse: bool = True,
-        offset_date: Optional[datetime] = None,
-    ) -> None:
-        
-        try:
-            async for message in self.iter_messages(
-                entity=origin_chat,
-                limit=limit,
-                offset_id=offset_id,
-                offset_date=offset_date,
-                reverse=reverse
-            ):
-                      
-                print(f"Fetched message ID: {message.id}")
-                await self.messages_queue.put(message)
+        while True:
+            try:
+                return await request(**kwargs)
 
-                if message.id == self.last_msg_id:
-                    self.finished_queue = True
-                    print("All messages fetched")
-                    return
-              
-        except FloodWaitError as e:
-            print(f"FloodError detected, it's normal. Waiting {e.value} seconds...")
-            await asyncio.sleep(e.seconds)
+            except (FloodWaitError, FloodPremiumWaitError) as e:
+                metrics.flood_wait_seconds.inc(kind, amount=e.seconds)
+                print(f"FloodError detected, it's normal. Waiting {e.seconds} seconds...")
+                await asyncio.sleep(e.seconds)
 
-    async def _queue_downloads(
-        self, 
+    async def _download_media(
+        self,
         message: Message,
-    ) -> Message|None:
-   
+        download_dir: Optional[Path] = None,
+    ) -> str:
 
         # We first try to get from the telegram atribute
         # I added the message_id, to avoid filename conflicts
         # Since telegram can have two files with the same name in a group
         # If we don't provide a filename it will be random
         filename = get_file_name(message)
+        download_dir = download_dir or self.download_dir
 
         if filename:
-            file_path = self.download_dir / f"message_{message.id}_{filename}"
+            file_path = download_dir / f"message_{message.id}_{filename}"
         else:
-            file_path = self.download_dir / f"{message.id}_temp"
-        
-        # await fast_download(
-        #    client=self,
-        #    message=message,
-        #    file_path=str(file_path),
-        #    progress_callback=create_progress_callback(
-        #        f"Downloading message_id:{message.id}")
-        # )
-
-        file_path = await self.download_media(
-            message=message, 
+            file_path = download_dir / f"{message.id}_temp"
+
+        progress_callback = create_progress_callback()
+
+        # Big documents are worth the parallel connections, for photos
+        # and small files the telethon download is fast enough
+        if (
+            message.document and
+            message.file.size >= settings.fast_download_min_size
+        ):
+            await fast_download(
+                client=self,
+                message=message,
+                file_path=str(file_path),
+                progress_callback=progress_callback,
+            )
+            return str(file_path)
+
+        return await self._retry_floods(
+            "download",
+            self.download_media,
+            message=message,
             file=str(file_path),
-            progress_callback=create_progress_callback(
-                f"Downloading message_id:{message.id}"),
+            progress_callback=progress_callback,
         )
-        
-        # Sometimes the file in the telegram doesn't have filename
-        # Which has the extension that is a requirement to telegram upload
-        await self.download_queue.put((message, file_path))
+
+    async def _rate_limited(
+        self,
+        kind: str,
+        chat_id: int | str,
+        request: Callable[..., Awaitable],
+        turn: Optional[Callable[[], Awaitable]] = None,
+        path: Optional[str] = None,
+        **kwargs,
+    ) -> Any:
+        """
+        Sends the request when the limiter allows it, and lets the
+        limiter know how it went. After a FloodWait it slows down this
+        kind of request to the chat and tries again.
+        With a turn, it first waits for it, so everything taken before
+        it is sent first, by any of the accounts.
+        The messages sent are counted under the path, for the metrics.
+        """
+
+        if turn:
+            with tracer.span("turn"):
+                await turn()
+
+        while True:
+            with tracer.span("limiter", kind=kind):
+                await self.limiter.acquire(kind, chat_id)
+
+            try:
+                with tracer.span("send", kind=kind, path=path):
+                    result = await request(**kwargs)
+
+            except (FloodWaitError, FloodPremiumWaitError) as e:
+                print(f"FloodError detected, it's normal. Waiting {e.seconds} seconds...")
+                self.limiter.flood(kind, chat_id, e.seconds)
+                continue
+
+            self.limiter.success(kind, chat_id)
+            if path:
+                sent = len(result) if isinstance(result, list) else 1
+                metrics.messages.inc(path, amount=sent)
+            return result
 
     async def _send_copy_message(
         self,
         chat_id: int | str,
         message: Message,
         reply_to_message_id: int | None = None,
-        file_path: str | None = None,
+        file_path: str | TypeInputFile | None = None,
         thumb: str | None = None,
         media: bool = False,
         group_policy: bool = False,
+        turn: Optional[Callable[[], Awaitable]] = None,
     ) -> Message | None:
 
-        # If it's not a file upload 
+        # If it's not a file upload
         if not file_path:
-            if not message.noforwards and not group_policy: 
-                return await self.forward_messages(
+            if not message.noforwards and not group_policy:
+                return await self._rate_limited(
+                    "forward",
+                    chat_id,
+                    self.forward_messages,
+                    turn=turn,
+                    path="forward",
                     entity=chat_id,
                     messages=message,
                     from_peer=message.chat.id,
                     drop_author=True,
                 )
-            
+
             # If the groups o rmessage is restricted
             else:
                 # Since users can't send messages, we insert in the messa.text
@@ -182,23 +276,605 @@ class Bot(TelegramClient):
                             if button.url:
                                 message.text += f"\n**[Acessar]({button.url})**"
 
-                return await self.send_message(
+                return await self._rate_limited(
+                    "send",
+                    chat_id,
+                    self.send_message,
+                    turn=turn,
+                    path="copy",
                     entity=chat_id,
                     message=message,
                     reply_to=reply_to_message_id,
                 )
 
-        return await self.send_file(
+        progress_callback = create_progress_callback()
+        upload_session = None
+
+        # Big documents go through FastTelethon, if the upload drops
+        # halfway the next attempt only sends the missing parts
+        if (
+            isinstance(file_path, str) and
+            message.document and
+            os.path.getsize(file_path) >= settings.fast_upload_min_size
+        ):
+            upload_session = UploadSession(file_path)
+            with tracer.span("upload", size=os.path.getsize(file_path)):
+                file_path = await fast_upload(
+                    client=self,
+                    file_path=file_path,
+                    file_name=message.file.name,
+                    progress_callback=progress_callback,
+                )
+
+        # Relayed media is already uploaded, without a file on disk
+        # telethon can't guess the attributes, so we reuse the original
+        attributes = None
+        if isinstance(file_path, (InputFile, InputFileBig)):
+            attributes = message.document.attributes
+
+        sent = await self._rate_limited(
+            "upload",
+            chat_id,
+            self.send_file,
+            turn=turn,
+            path="upload",
             entity=chat_id,
             file=file_path,
             file_name=message.file.name,
             caption=message.text,
             reply_to=reply_to_message_id,
-            progress_callback=create_progress_callback(
-                f"Uploading   message_id:{message.id}"
-            ),
+            attributes=attributes,
+            progress_callback=progress_callback,
+        )
+
+        if upload_session:
+            upload_session.remove()
+
+        return sent
+
+
+    async def _send_media_copy(
+        self,
+        chat_id: int | str,
+        message: Message,
+        media: Any,
+        reply_to_message_id: int | None = None,
+        turn: Optional[Callable[[], Awaitable]] = None,
+    ) -> Message:
+
+        # Media that is already in the destiny chat goes again without
+        # any download or upload, only the caption is the new one
+        return await self._rate_limited(
+            "send",
+            chat_id,
+            self.send_file,
+            turn=turn,
+            path="reused",
+            entity=chat_id,
+            file=media,
+            caption=message.text,
+            reply_to=reply_to_message_id,
+        )
+
+    async def _send_album(
+        self,
+        chat_id: int | str,
+        messages: list[Message],
+        file_paths: list[str],
+        reply_to_message_id: int | None = None,
+        turn: Optional[Callable[[], Awaitable]] = None,
+    ) -> list[Message]:
+
+        # One request for the whole album, keeping it grouped
+        return await self._rate_limited(
+            "upload",
+            chat_id,
+            self.send_file,
+            turn=turn,
+            path="upload",
+            entity=chat_id,
+            file=file_paths,
+            caption=[message.text for message in messages],
+            reply_to=reply_to_message_id,
+            progress_callback=create_progress_callback(),
+        )
+
+    async def _forward_batch(
+        self,
+        destiny_chat: Chat,
+        messages: list[Message],
+        turn: Optional[Callable[[], Awaitable]] = None,
+    ) -> list[Message]:
+
+        print(f"Forwarded message_ids {messages[0].id}-{messages[-1].id}")
+        return await self._rate_limited(
+            "forward",
+            destiny_chat.id,
+            self.forward_messages,
+            turn=turn,
+            path="forward",
+            entity=destiny_chat.id,
+            messages=messages,
+            from_peer=messages[0].chat.id,
+            drop_author=True,
+        )
+
+    async def _own_messages(
+        self,
+        origin_chat: Chat,
+        messages: list[Message],
+    ) -> list[Message]:
+        # Messages fetched by another account carry its file references
+        # and access hashes, this account needs its own copies of them
+        own = await self._retry_floods(
+            "get_messages",
+            self.get_messages,
+            entity=origin_chat,
+            ids=[message.id for message in messages],
+        )
+        return [message for message in own if message]
+
+    def add_shard(self, bot: "Bot") -> None:
+        """
+        Adds another account to share the work of the clones, with its
+        own rate limiter, connections and download workers.
+        """
+        self.shards.append(bot)
+
+    def _is_forwardable(self, message: Message, origin_chat: Chat) -> bool:
+        return not (
+            isinstance(message, MessageService) or
+            message.noforwards or
+            origin_chat.noforwards
         )
 
+    def _describe(self, message: Message | list[Message]) -> str:
+        if isinstance(message, list):
+            return f"album message_ids:{message[0].id}-{message[-1].id}"
+        return f"message_id:{message.id}"
+
+    def _needs_download(self, message: Message, origin_group: Chat) -> bool:
+        # Protected media can't be forwarded or copied, only uploaded
+        return bool(
+            not isinstance(message, MessageService) and
+            (origin_group.noforwards or message.noforwards) and
+            message.media
+        )
+
+    async def clone_messages(
+        self,
+        origin_group_id: int|str,
+        destiny_group_id: int|str,
+        new_group_name: Optional[str] = None,
+        topic_id: Optional[int] = None,
+        offset_id: Optional[int] = 0,
+        offset_date: Optional[datetime] = None,
+        checkpoints: Optional[CheckpointStore] = None,
+    ) -> None:
+
+        store = checkpoints or CheckpointStore(
+            settings.checkpoints_file, settings.checkpoint_interval
+        )
+
+        try:
+            await CloneJob(
+                bot=self,
+                name=str(origin_group_id),
+                origin_group_id=origin_group_id,
+                destiny_group_id=destiny_group_id,
+                checkpoints=store,
+                topic_id=topic_id,
+                offset_id=offset_id,
+                offset_date=offset_date,
+            ).run()
+        finally:
+            if not checkpoints:
+                store.close()
+
+    async def _open_chats(
+        self,
+        origin_group_id: int|str,
+        destiny_group_id: int|str,
+    ) -> tuple[Chat, Chat] | None:
+
+        # Get open dialogs, in case it's a privated chat, etc...
+        await self._retry_floods("dialogs", self.get_dialogs)
+
+        try:
+            origin_chat = await self._retry_floods(
+                "entity", self.get_entity, entity=origin_group_id
+            )
+            print(f"Origin group: {origin_chat.title} is alright")
+        except Exception as e:
+            print(f"Error with origin chat: {e}")
+            return None
+
+        try:
+            destiny_chat = await self._retry_floods(
+                "entity", self.get_entity, entity=destiny_group_id
+            )
+            print(f"Destiny group is alright")
+        except Exception as e:
+            print(f"Error with destiny chat: {e}")
+            return None
+
+        return origin_chat, destiny_chat
+
+
+class CloneJob:
+    """
+    Clones one origin chat into one destiny chat. Many of them can run
+    at the same time, sharing the accounts of the bot with their rate
+    limiters and connections, each with its own queues and workers.
+
+    What happens to every message is saved in the checkpoint store
+    under the job name, a job started again goes on from there.
+    """
+
+    def __init__(
+        self,
+        bot: Bot,
+        name: str,
+        origin_group_id: int|str,
+        destiny_group_id: int|str,
+        checkpoints: CheckpointStore,
+        topic_id: Optional[int] = None,
+        offset_id: Optional[int] = 0,
+        offset_date: Optional[datetime] = None,
+        download_workers: Optional[int] = None,
+        dispatch_ahead: Optional[int] = None,
+        scheduler: Optional[FairScheduler] = None,
+    ) -> None:
+        self.bot = bot
+        self.name = name
+        self.checkpoints = checkpoints
+        self.origin_group_id = origin_group_id
+        self.destiny_group_id = destiny_group_id
+        self.topic_id = topic_id
+        self.offset_id = offset_id or 0
+        self.offset_date = offset_date
+
+        self.messages_queue = asyncio.Queue()
+        self.download_queue = asyncio.Queue()
+
+        # Protected media waiting for a free download worker
+        self.pending_downloads = asyncio.Queue(
+            maxsize=settings.download_queue_size
+        )
+        self.download_workers = download_workers or settings.download_workers
+
+        # Batches handed out ahead of the one being sent, and the slots
+        # shared with the other jobs they take turns for
+        self.dispatch_ahead = dispatch_ahead or settings.dispatch_ahead
+        self.scheduler = scheduler or FairScheduler(settings.max_dispatching)
+
+        # Each job downloads to its own folder, ids repeat among chats
+        self.download_dir = bot.download_dir / name
+        self.download_dir.mkdir(exist_ok=True)
+
+        self.finished_queue = False
+        self.finished_dequeue = False
+
+        # History is fetched in the background, between these marks, so
+        # sending never stops to wait for the next page
+        self.history_high_water = settings.history_high_water
+        self.history_low_water = settings.history_low_water
+        self.history_drained = asyncio.Event()
+        self.history_ended = False
+        self.last_fetched_id = 0
+
+        # The batches are numbered so they are sent in the order they
+        # were taken, whatever account sends them. Each account has
+        # its own view of both chats
+        self.sequencer = Sequencer()
+        self.chats: dict[Bot, tuple[Chat, Chat]] = {}
+
+        # Messages whose file reference expired are fetched again by
+        # the account that has them, while the rest keeps going
+        self.refreshers: dict[Bot, MessageRefresher] = {}
+
+        # Destiny messages whose media is sent again for reposts
+        self.destiny_messages: dict[Bot, MessageRefresher] = {}
+
+        # Messages after the resume point that were already sent
+        self.done_ids: set[int] = set()
+
+        # When each message was fetched and each download queued, for
+        # the time they waited, only while tracing
+        self.fetched_at: dict[int, float] = {}
+        self.queued_at: dict[int, float] = {}
+
+        # Consecutive forwardable messages go in a single request, the
+        # first message that ends a batch waits here for its turn
+        self.forward_batch_size = settings.forward_batch_size
+        self.held_message = None
+
+    @property
+    def shards(self) -> list[Bot]:
+        return self.bot.shards
+
+    def _turn(self, sequence: Optional[int]) -> Callable[[], Awaitable]:
+        return partial(self.sequencer.wait, sequence)
+
+    async def _get_chat_messages(
+        self,
+        origin_chat: Chat,
+        offset_id: int = 0,
+        limit: int = 100,
+        reverse: bool = True,
+        offset_date: Optional[datetime] = None,
+    ) -> int:
+
+        fetched = []
+
+        with tracer.span("fetch", job=self.name, ids=fetched):
+            async for message in self.bot.iter_messages(
+                entity=origin_chat,
+                limit=limit,
+                offset_id=offset_id,
+                offset_date=offset_date,
+                reverse=reverse
+            ):
+                print(f"Fetched message ID: {message.id}")
+                if tracer.enabled:
+                    self.fetched_at[message.id] = time.time()
+                await self.messages_queue.put(message)
+                self.last_fetched_id = message.id
+                fetched.append(message.id)
+
+                if message.id == self.last_msg_id:
+                    self.finished_queue = True
+                    print(f"[{self.name}] All messages fetched")
+                    break
+
+        return len(fetched)
+
+    async def _prefetch_history(
+        self,
+        origin_chat: Chat,
+        offset_date: Optional[datetime] = None,
+    ) -> None:
+        """
+        Producer that keeps the messages queue filled in the background.
+        When the queue drops to the low water mark it fetches up to the
+        high water mark, going on from the last fetched message, so a
+        FloodWait only delays it. When the history ends, or fetching it
+        failed, it puts None in the queue.
+        """
+
+        try:
+            while not self.finished_queue:
+
+                # Wait for the sender to drain the queue down to the low mark
+                if self.messages_queue.qsize() > self.history_low_water:
+                    self.history_drained.clear()
+                    await self.history_drained.wait()
+                    continue
+
+                try:
+                    fetched = await self._get_chat_messages(
+                        origin_chat=origin_chat,
+                        offset_id=self.last_fetched_id,
+                        limit=max(
+                            self.history_high_water -
+                            self.messages_queue.qsize(), 1
+                        ),
+                        offset_date=offset_date,
+                    )
+
+                except FloodWaitError as e:
+                    metrics.flood_wait_seconds.inc("history", amount=e.seconds)
+                    print(f"FloodError detected, it's normal. Waiting {e.seconds} seconds...")
+                    await asyncio.sleep(e.seconds)
+                    continue
+
+                # Also the end, in case the last message was deleted
+                if not fetched and not self.finished_queue:
+                    self.finished_queue = True
+                    print(f"[{self.name}] All messages fetched")
+
+        finally:
+            # Also when fetching failed, the sender would wait forever
+            # for the rest of the history
+            self.messages_queue.put_nowait(None)
+
+    async def _refreshing(
+        self,
+        shard: Bot,
+        message: Message | list[Message],
+        request: Callable[[Message | list[Message]], Awaitable],
+    ) -> tuple[Any, Message | list[Message] | None]:
+        """
+        Runs the request with the message, and when its file reference
+        expired fetches the message again and tries again, without
+        touching anything else waiting in the queues.
+        Returns what the request returned and the message it used, the
+        message is None, or an empty list, if it was deleted meanwhile.
+        """
+
+        for attempt in range(1, settings.refresh_attempts + 1):
+            try:
+                return await request(message), message
+
+            except FileReferenceExpiredError:
+                if attempt == settings.refresh_attempts:
+                    raise
+                print(
+                    f"File reference of {shard._describe(message)}"
+                    " expired, refreshing..."
+                )
+
+                with tracer.span("refresh"):
+                    fresh = await self.refreshers[shard].refresh(message)
+
+                # The ones deleted meanwhile won't be sent
+                if isinstance(message, list):
+                    kept = {item.id for item in fresh}
+                    self._checkpoint(
+                        [item for item in message if item.id not in kept],
+                        SKIPPED,
+                    )
+                message = fresh
+
+                if not message:
+                    return None, message
+
+    async def _queue_downloads(
+        self,
+        shard: Bot,
+        message: Message | list[Message],
+        sequence: Optional[int] = None,
+    ) -> None:
+
+        # Waits for room on disk for all of it before it's queued. An
+        # album reserving its files one by one could wait forever for
+        # the rest, and a download waiting in a worker could keep the
+        # one whose turn it is from ever getting a worker
+        size = self._download_size(message)
+        with tracer.span("disk", size=size):
+            await self.bot.spool.reserve(size, turn=self._turn(sequence))
+
+        # Blocks while all the workers are busy and the queue is full,
+        # so we don't keep fetching history we can't handle yet
+        if tracer.enabled:
+            self.queued_at[sequence] = time.time()
+        try:
+            await self.pending_downloads.put((sequence, shard, message, size))
+        except BaseException:
+            self.bot.spool.unreserve(size)
+            raise
+
+    async def _download_worker(self) -> None:
+
+        while True:
+            item = await self.pending_downloads.get()
+
+            # No more messages to download
+            if item is None:
+                self.pending_downloads.task_done()
+                break
+
+            sequence, shard, message, size = item
+
+            tracer.follow(self.name, message)
+            if tracer.enabled:
+                tracer.record(
+                    "download_queue", self.queued_at.pop(sequence), time.time()
+                )
+
+            try:
+                with tracer.span("download", size=size):
+                    file_path, fresh = await self._refreshing(
+                        shard, message, partial(self._download, shard)
+                    )
+
+                # Deleted before we could download it again
+                if not fresh:
+                    self._checkpoint(message, SKIPPED)
+                    self.sequencer.done(sequence)
+                    continue
+
+                # Sometimes the file in the telegram doesn't have filename
+                # Which has the extension that is a requirement to telegram upload
+                self._checkpoint(fresh, DOWNLOADED)
+                await self.download_queue.put(
+                    (sequence, shard, fresh, file_path)
+                )
+
+            except Exception as e:
+                print(f"Error downloading {shard._describe(message)}:", e)
+                self._checkpoint(message, FAILED)
+                self.sequencer.done(sequence)
+
+            finally:
+                # The files downloaded now count on their own
+                self.bot.spool.unreserve(size)
+                self.pending_downloads.task_done()
+
+    async def _download(
+        self,
+        shard: Bot,
+        message: Message | list[Message],
+    ) -> str | list[str] | TypeInputFile:
+        if (
+            not isinstance(message, list) and
+            settings.relay_media and
+            message.document
+        ):
+            file = await fast_relay(
+                client=shard,
+                message=message,
+                window=settings.relay_window,
+                progress_callback=create_progress_callback(),
+            )
+            metrics.messages.inc("download")
+            return file
+
+        if not isinstance(message, list):
+            return await self._download_file(shard, message)
+
+        # Every media of an album is downloaded at the same time
+        file_paths = await asyncio.gather(
+            *[self._download_file(shard, item) for item in message],
+            return_exceptions=True,
+        )
+        errors = [
+            error for error in file_paths
+            if isinstance(error, BaseException)
+        ]
+        if errors:
+            for file_path in file_paths:
+                if not isinstance(file_path, BaseException):
+                    self.bot.spool.release(file_path)
+            raise errors[0]
+        return file_paths
+
+    def _download_size(self, message: Message | list[Message]) -> int:
+        # Relayed media never touches the disk
+        if (
+            not isinstance(message, list) and
+            settings.relay_media and
+            message.document
+        ):
+            return 0
+
+        messages = message if isinstance(message, list) else [message]
+        return sum(item.file.size or 0 for item in messages if item.file)
+
+    async def _download_file(self, shard: Bot, message: Message) -> str:
+        # Reposts of a media already downloaded use the same file, and so
+        # does a job started again. Only the index says a file is whole,
+        # one killed halfway can have its full size already
+        media = message_media(message)
+        if media:
+            file_path = self.checkpoints.media.file(media)
+            if file_path:
+                print(f"Media of message_id:{message.id} already downloaded")
+                self.bot.spool.use(file_path)
+                return file_path
+
+            # An earlier file of it may have been evicted, the one about
+            # to be downloaded in its place isn't whole until it's done
+            self.checkpoints.media.forget_file(media)
+            self.checkpoints.commit()
+
+        file_path = await shard._download_media(message, self.download_dir)
+        self.bot.spool.use(file_path)
+        metrics.messages.inc("download")
+
+        if media:
+            content_hash = await asyncio.to_thread(file_hash, file_path)
+            self.checkpoints.media.add_file(media, file_path, content_hash)
+        return file_path
+
+    async def _run_download_workers(self) -> None:
+        await asyncio.gather(
+            *[self._download_worker() for _ in range(self.download_workers)]
+        )
+
+        # Let the uploader know nothing else is coming
+        await self.download_queue.put(None)
+        print(f"[{self.name}] All medias downloaded")
 
     async def _send_messages(
         self,
@@ -215,187 +891,629 @@ class Bot(TelegramClient):
 
         It send messages if possible, otherwise put them for download
 
-        Forward disable: 
+        Forward disable:
             If downloadable media donwload, and upload after
             If non downloable media or message, send a copy
 
         Forward enable:
             If message content is protected, same approach as forward disable
-            Just mass forward with limit rate normally
-        
+            Just mass forward with limit rate normally, consecutive
+            forwardable messages go together in a single request
+
+        The history is fetched by a separate task, so there are always
+        messages waiting here while the next page is on its way.
+
         Exceptions:
-            FileReferenceExpired, when detected we have to clean all our 
-            queues and fetch the messages again where the error has occurred
+            FileReferenceExpired, when detected only the message where it
+            occurred is fetched again and retried, the queues keep going
 
         FloodError
            Telegram is impling limit and tell us to slow down. Just wait X time in seconds
            Usually 15 seconds for upload and 10 seconds for donwload.
         """
 
-        self.last_processed_msg = offset_id
-        self.last_msg_id = await self.get_last_message(origin_chat)
+        self.last_fetched_id = offset_id
+        self.last_msg_id = await self.bot.get_last_message(origin_chat)
 
-        while True:
-            
-            if self.messages_queue.empty():
-                if self.finished_queue:
+        prefetcher = asyncio.create_task(
+            self._prefetch_history(origin_chat, offset_date)
+        )
+
+        # Batches being sent or waiting for their turn to be sent
+        dispatching = set()
+        dispatch_slots = asyncio.Semaphore(self.dispatch_ahead)
+
+        try:
+            while True:
+
+                batch = await self._next_batch(origin_chat)
+
+                # Time for the prefetcher to fetch the next page
+                if self.messages_queue.qsize() <= self.history_low_water:
+                    self.history_drained.set()
+
+                # The prefetcher reached the end of the history
+                if batch is None:
                     break
-                
-                print("All messages processed, fetching more...")
-                await self._get_chat_messages(
-                    origin_chat=origin_chat,
-                    offset_id=self.last_processed_msg,
-                    offset_date=offset_date,
-                ) 
 
-            while not self.bucket.consume():
-                print("Preveting flood, waiting seconds:", self.interval)
-                await asyncio.sleep(self.interval)
+                for _ in batch:
+                    self.messages_queue.task_done()
 
-            message: Message = await self.messages_queue.get()
-                       
-            try:
-                await self._messages_trial(
-                    destiny_group=destiny_chat, 
-                    origin_group=origin_chat,
-                    message=message,
-                    topic_id=topic_id,
+                if tracer.enabled:
+                    tracer.record(
+                        "queue",
+                        min(
+                            self.fetched_at.pop(message.id)
+                            for message in batch
+                        ),
+                        time.time(),
+                        job=self.name,
+                        ids=[message.id for message in batch],
+                    )
+
+                # Sent before the job was stopped last time
+                batch = [
+                    message for message in batch
+                    if message.id not in self.done_ids
+                ]
+                if not batch:
+                    continue
+
+                self._checkpoint(batch, QUEUED)
+
+                await dispatch_slots.acquire()
+                try:
+                    await self.scheduler.acquire(self.name)
+                except BaseException:
+                    dispatch_slots.release()
+                    raise
+
+                task = asyncio.create_task(
+                    self._dispatch_batch(
+                        sequence=self.sequencer.number(),
+                        batch=batch,
+                        topic_id=topic_id,
+                    )
                 )
-           
-            except FileReferenceExpiredError:
-                print("File reference expired, refreshing...")
-                empty_queue(self.messages_queue)
-                empty_queue(self.download_queue)
-            
-            finally:
-                self.last_processed_msg = message.id
-                self.messages_queue.task_done()
+                dispatching.add(task)
+                task.add_done_callback(dispatching.discard)
+                task.add_done_callback(lambda _: dispatch_slots.release())
+                task.add_done_callback(lambda _: self.scheduler.release())
+
+            await asyncio.gather(*dispatching)
+
+            # The history may have ended because fetching it failed
+            await prefetcher
+
+        finally:
+            # Nothing of the job keeps running if it's cancelled
+            prefetcher.cancel()
+            for task in dispatching:
+                task.cancel()
 
-        print("All messages processed")
+        print(f"[{self.name}] All messages processed")
         self.finished_dequeue = True
 
+        # One stop signal for each download worker
+        for _ in range(self.download_workers):
+            await self.pending_downloads.put(None)
+
+    async def _dispatch_batch(
+        self,
+        sequence: int,
+        batch: list[Message],
+        topic_id: Optional[int] = None,
+    ) -> None:
+        """
+        Hands the batch to the account whose turn it is, that sends it
+        or queues it for download using its own copy of the messages.
+        Unless the batch went for download, its turn ends here.
+        """
+
+        shard = self.shards[sequence % len(self.shards)]
+        origin_chat, destiny_chat = self.chats[shard]
+        queued = False
+        tracer.follow(self.name, batch)
+
+        try:
+            messages = batch
+            if shard is not self.bot:
+                with tracer.span("own_messages"):
+                    messages = await shard._own_messages(origin_chat, batch)
+
+            # Deleted before this account got to it, those won't be sent
+            kept = {message.id for message in messages}
+            deleted = [message for message in batch if message.id not in kept]
+            if deleted:
+                self._checkpoint(deleted, SKIPPED)
+            if not messages:
+                return
+
+            if len(messages) > 1 and shard._is_forwardable(
+                messages[0], origin_chat
+            ):
+                sent, messages = await self._refreshing(
+                    shard,
+                    messages,
+                    partial(
+                        shard._forward_batch,
+                        destiny_chat,
+                        turn=self._turn(sequence),
+                    ),
+                )
+                if messages:
+                    self._checkpoint(messages, SENT, sent)
+
+            # A protected album, downloaded and sent as one
+            elif len(messages) > 1:
+                await self._queue_downloads(shard, messages, sequence)
+                queued = True
+
+            elif shard._needs_download(messages[0], origin_chat):
+                sent = await self._send_known_media(
+                    shard, messages[0], topic_id, sequence
+                )
+                if sent:
+                    self._checkpoint(messages, SENT, sent)
+                else:
+                    await self._queue_downloads(shard, messages[0], sequence)
+                    queued = True
+
+            else:
+                sent, message = await self._refreshing(
+                    shard,
+                    messages[0],
+                    partial(
+                        self._messages_trial,
+                        shard,
+                        destiny_chat,
+                        origin_chat,
+                        topic_id=topic_id,
+                        sequence=sequence,
+                    ),
+                )
+
+                # Service and deleted messages are skipped
+                if sent:
+                    self._checkpoint(message, SENT, sent)
+                else:
+                    self._checkpoint(messages, SKIPPED)
+
+        except Exception as e:
+            print(f"Error sending {shard._describe(batch)}:", e)
+            self._checkpoint(batch, FAILED)
+
+        finally:
+            if not queued:
+                self.sequencer.done(sequence)
+
+    def _checkpoint(
+        self,
+        messages: Message | list[Message],
+        status: str,
+        sent: Message | list[Message] | None = None,
+    ) -> None:
+        # The sent messages come in the same order as the originals
+        messages = messages if isinstance(messages, list) else [messages]
+        sent = sent if isinstance(sent, list) else [sent]
+        self.checkpoints.mark(
+            job=self.name,
+            message_ids=[message.id for message in messages],
+            status=status,
+            # A message that failed keeps its place, so the ids after
+            # it still pair with their originals
+            destiny_ids=[message.id if message else None for message in sent],
+        )
+        if status == SENT:
+            reporter.sent(len(messages))
+
+    async def _next_batch(self, origin_chat: Chat) -> list[Message] | None:
+        """
+        Takes the next message from the queue, and if it can be forwarded
+        the forwardable messages right after it that are already waiting,
+        up to the 100 ids telegram accepts in one request.
+        If it can't be forwarded but belongs to an album, the rest of
+        the album comes with it.
+        An album may go on in the next page of the history, while the
+        batch ends with one, it waits for the next message.
+        The first message that can't go in the batch is held for later.
+        Returns None once the whole history was taken.
+        """
+
+        if self.held_message:
+            message, self.held_message = self.held_message, None
+        elif self.history_ended:
+            return None
+        else:
+            message = await self.messages_queue.get()
+            if message is None:
+                self.messages_queue.task_done()
+                return None
+
+        batch = [message]
+        forwardable = self.bot._is_forwardable(message, origin_chat)
+        if not forwardable and not message.grouped_id:
+            return batch
+
+        while len(batch) < self.forward_batch_size:
+            if not self.messages_queue.empty():
+                following = self.messages_queue.get_nowait()
+
+            # Nothing else is coming for this batch
+            elif self.history_ended or not batch[-1].grouped_id:
+                break
+
+            else:
+                # The prefetcher may be waiting for the queue to drain
+                self.history_drained.set()
+                following = await self.messages_queue.get()
+
+            # The end of the history, left for the next call
+            if following is None:
+                self.messages_queue.task_done()
+                self.history_ended = True
+                break
+
+            if forwardable:
+                belongs = self.bot._is_forwardable(following, origin_chat)
+            else:
+                belongs = following.grouped_id == message.grouped_id
+
+            if not belongs:
+                self.held_message = following
+                break
+
+            batch.append(following)
+
+        return batch
+
     async def _upload_downloads(
-        self, 
-        destiny_chat_id: int|str,
+        self,
         reply_to_message_id: Optional[int] = None
     ) -> Message|None:
 
         """
         Takes the message information and the file path in the downloads dir
         To upload the message with the same metadata as the original message
+
+        Each one uploads as soon as it's downloaded, and waits for its
+        turn to be sent
         """
 
-        while True:
+        uploading = set()
+
+        try:
+            while True:
 
-            if self.download_queue.empty():
-                if self.finished_dequeue:
+                item = await self.download_queue.get()
+                self.download_queue.task_done()
+
+                # The download workers are done
+                if item is None:
                     break
-                await asyncio.sleep(5)
-            
-            message, file_path = await self.download_queue.get()
-           
-            try:
-                await self._send_copy_message(
-                    chat_id=destiny_chat_id,
-                    message=message,
-                    reply_to_message_id=reply_to_message_id,
-                    file_path=file_path,
+
+                task = asyncio.create_task(
+                    self._upload_download(
+                        *item,
+                        reply_to_message_id=reply_to_message_id,
+                    )
                 )
+                uploading.add(task)
+                task.add_done_callback(uploading.discard)
 
-            except FileReferenceExpiredError:
-                print("File reference expired, refreshing...")
-                empty_queue(self.messages_queue)
-                empty_queue(self.download_queue)
+            await asyncio.gather(*uploading)
 
-            except Exception as e:
-                print("Error in message trial:", e)
-        
-            finally:
-                self.last_processed_msg = message.id
-                self.download_queue.task_done()
+        finally:
+            for task in uploading:
+                task.cancel()
+
+        print(f"[{self.name}] All medias uploaded")
+
+    async def _upload_download(
+        self,
+        sequence: Optional[int],
+        shard: Bot,
+        message: Message | list[Message],
+        file_path: str | list[str] | TypeInputFile,
+        reply_to_message_id: Optional[int] = None,
+    ) -> None:
+
+        destiny_chat_id = self.chats[shard][1].id
+        tracer.follow(self.name, message)
+
+        if isinstance(message, list):
+            file_path = dict(zip([item.id for item in message], file_path))
+
+        try:
+            # Connection drops are worth another try, the parts that
+            # already got to telegram are not sent again
+            for attempt in range(1, settings.upload_attempts + 1):
+                try:
+                    sent, fresh = await self._refreshing(
+                        shard,
+                        message,
+                        partial(
+                            self._send_download,
+                            shard,
+                            destiny_chat_id,
+                            file_path=file_path,
+                            reply_to_message_id=reply_to_message_id,
+                            sequence=sequence,
+                        ),
+                    )
+                    if fresh:
+                        self._checkpoint(fresh, SENT, sent)
+                        self._index_sent(shard, fresh, sent)
+                    else:
+                        self._checkpoint(message, SKIPPED)
+                    break
+
+                except ConnectionError:
+                    if attempt == settings.upload_attempts:
+                        raise
+                    print(
+                        f"Upload of {shard._describe(message)} dropped,"
+                        " trying again..."
+                    )
+
+        except Exception as e:
+            print("Error in message trial:", e)
+            self._checkpoint(message, FAILED)
+
+        finally:
+            self.sequencer.done(sequence)
+
+            # Uploaded or not, the files go to the cache
+            file_paths = (
+                file_path.values() if isinstance(file_path, dict)
+                else [file_path]
+            )
+            for path in file_paths:
+                if isinstance(path, str):
+                    self.bot.spool.release(path)
+
+    async def _send_download(
+        self,
+        shard: Bot,
+        chat_id: int,
+        message: Message | list[Message],
+        file_path: str | dict[int, str] | TypeInputFile,
+        reply_to_message_id: Optional[int] = None,
+        sequence: Optional[int] = None,
+    ) -> Message | list[Message]:
+
+        # Album files go by message id, a refreshed album may have lost
+        # some of its messages
+        if isinstance(message, list):
+            return await shard._send_album(
+                chat_id=chat_id,
+                messages=message,
+                file_paths=[file_path[item.id] for item in message],
+                reply_to_message_id=reply_to_message_id,
+                turn=self._turn(sequence),
+            )
+
+        # The content is known only now, it may be a repost after all
+        sent = await self._send_known_media(
+            shard, message, reply_to_message_id, sequence
+        )
+        if sent:
+            return sent
+
+        return await shard._send_copy_message(
+            chat_id=chat_id,
+            message=message,
+            reply_to_message_id=reply_to_message_id,
+            file_path=file_path,
+            turn=self._turn(sequence),
+        )
+
+    async def _send_known_media(
+        self,
+        shard: Bot,
+        message: Message,
+        reply_to_message_id: Optional[int] = None,
+        sequence: Optional[int] = None,
+    ) -> Message | None:
+        """
+        Sends the media again from the destiny message that already has
+        it, when it was sent before. Returns None when it wasn't, or
+        when that destiny message is gone.
+        """
+
+        media = message_media(message)
+        if not media:
+            return None
+
+        destiny_chat = self.chats[shard][1]
+        account = self._media_account(shard)
+        destiny_id = self.checkpoints.media.destiny(
+            media, destiny_chat.id, account
+        )
+        if not destiny_id:
+            return None
+
+        previous, = await self.destiny_messages[shard].fetch([destiny_id])
+        if not previous or not previous.media:
+            self.checkpoints.media.forget_sent(
+                destiny_chat.id, account, destiny_id
+            )
+            return None
+
+        print(
+            f"Media of message_id:{message.id} already sent,"
+            f" sending again from message_id:{destiny_id}"
+        )
+        return await shard._send_media_copy(
+            chat_id=destiny_chat.id,
+            message=message,
+            media=previous.media,
+            reply_to_message_id=reply_to_message_id,
+            turn=self._turn(sequence),
+        )
 
+    def _index_sent(
+        self,
+        shard: Bot,
+        messages: Message | list[Message],
+        sent: Message | list[Message],
+    ) -> None:
+        # The sent messages come in the same order as the originals
+        messages = messages if isinstance(messages, list) else [messages]
+        sent = sent if isinstance(sent, list) else [sent]
+        destiny_chat = self.chats[shard][1]
+        account = self._media_account(shard)
 
-        print("All medias uploaded")
+        for message, copy in zip(messages, sent):
+            media = message_media(message)
+            if media and copy:
+                self.checkpoints.media.add_sent(
+                    media, destiny_chat.id, account, copy.id
+                )
+
+    def _media_account(self, shard: Bot) -> str:
+        # In channels every account sees the same message ids, in
+        # private chats and basic groups each one has its own
+        if isinstance(self.chats[shard][1], Channel):
+            return ""
+        return shard.account_name
 
     async def _messages_trial(
-        self, 
+        self,
+        shard: Bot,
         destiny_group: Chat,
         origin_group: Chat,
         message: Message,
-        topic_id: Optional[int] = None
+        topic_id: Optional[int] = None,
+        sequence: Optional[int] = None,
     ) -> Message|None:
 
         # Send copy messages, it's same as a forward but, copying the
         # content, so it works for unrestricted and restricted content
         # Does't work with resctricted media, that we have to download
-       
+
         if isinstance(message, MessageService):
             print(f"Skipping message ID {message.id} as it's a service message.")
             return None
-        
 
-        protected_content_media = (
-            (
-                origin_group.noforwards or 
-                message.noforwards 
-            ) and message.media
-        )
 
-        if protected_content_media:
-            return await self._queue_downloads(message)
-        
+        if shard._needs_download(message, origin_group):
+            return await self._queue_downloads(shard, message, sequence)
+
         else:
             print("Copied message_id", message.id)
-            return await self._send_copy_message(
+            return await shard._send_copy_message(
                 chat_id=destiny_group.id,
                 message=message,
                 reply_to_message_id=topic_id,
-                group_policy=origin_group.noforwards
+                group_policy=origin_group.noforwards,
+                turn=self._turn(sequence),
             )
 
-    async def clone_messages(
-        self, 
-        origin_group_id: int|str,
-        destiny_group_id: int|str,
-        new_group_name: Optional[str] = None,
-        topic_id: Optional[int] = None,
-        offset_id: Optional[int] = 0,
-        offset_date: Optional[datetime] = None
-    ) -> None:
-       
-        # Get open dialogs, in case it's a privated chat, etc...
-        await self.get_dialogs()
+    async def run(self) -> None:
 
-        try:
-            origin_chat = await self.get_entity(origin_group_id)
-            print(f"Origin group: {origin_chat.title} is alright")
-        except Exception as e:
-            print(f"Error with origin chat: {e}")
-            return
+        # Every account needs its own view of both chats
+        for shard in self.shards:
+            chats = await shard._open_chats(
+                self.origin_group_id, self.destiny_group_id
+            )
+            if not chats:
+                return
+            self.chats[shard] = chats
+            self.refreshers[shard] = MessageRefresher(
+                shard, chats[0], settings.refresh_delay
+            )
+            self.destiny_messages[shard] = MessageRefresher(
+                shard, chats[1], settings.refresh_delay
+            )
 
-        try:
-            destiny_chat = await self.get_entity(destiny_group_id)
-            print(f"Destiny group is alright")
-        except Exception as e:
-            print(f"Error with destiny chat: {e}")
-            return
+        origin_chat, destiny_chat = self.chats[self.bot]
+        print(f"\n>>> [{self.name}] Cloning {origin_chat.title}\n")
 
-        await asyncio.gather(
+        # Goes on from where it stopped last time, if it ran before
+        offset_id, self.done_ids = self.checkpoints.resume(self.name)
+        if offset_id is not None:
+            print(f"[{self.name}] Resuming after message_id:{offset_id}")
+            self.offset_id = offset_id
 
-            self._send_messages(
-                destiny_chat=destiny_chat,
-                origin_chat=origin_chat,
-                topic_id=topic_id,
-                offset_id=offset_id,
-                offset_date=offset_date,
+        # The depth of every stage shows in the progress line
+        stages = {
+            "history": self.messages_queue,
+            "downloads": self.pending_downloads,
+            "uploads": self.download_queue,
+        }
+        for stage, queue in stages.items():
+            reporter.watch(stage, queue)
+            metrics.queue_depth.track(queue.qsize, self.name, stage)
+        reporter.start()
 
+        tasks = [
+            asyncio.create_task(
+                self._send_messages(
+                    destiny_chat=destiny_chat,
+                    origin_chat=origin_chat,
+                    topic_id=self.topic_id,
+                    offset_id=self.offset_id,
+                    offset_date=self.offset_date,
+                )
+            ),
+            asyncio.create_task(self._run_download_workers()),
+            asyncio.create_task(
+                self._upload_downloads(
+                    reply_to_message_id=self.topic_id,
+                )
             ),
+        ]
 
-            self._upload_downloads(
-                destiny_chat_id=destiny_chat.id,
-                reply_to_message_id=topic_id,
-            )
-        )
+        try:
+            await asyncio.gather(*tasks)
+
+        finally:
+            # When one stage fails the others never get their None, and
+            # nothing of a failed job may keep downloading or posting
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+            for stage, queue in stages.items():
+                reporter.unwatch(stage, queue)
+                metrics.queue_depth.untrack(self.name, stage)
+
+        self.checkpoints.commit()
+
+
+async def run_jobs(
+    bot: Bot,
+    jobs: list[JobConfig],
+    checkpoints: CheckpointStore,
+) -> None:
+    """
+    Runs every job of the jobs file at once, in this same event loop.
+    Their batches take turns for the dispatch slots they share, so a
+    huge channel doesn't hold the others back until it's done. A job
+    that fails doesn't stop the others.
+    """
+
+    scheduler = FairScheduler(settings.max_dispatching)
+
+    async def run_job(job: JobConfig) -> None:
+        try:
+            await CloneJob(
+                bot=bot,
+                name=job.name,
+                origin_group_id=job.origin,
+                destiny_group_id=job.destiny,
+                checkpoints=checkpoints,
+                topic_id=job.topic_id,
+                offset_id=job.offset_id,
+                download_workers=job.download_workers,
+                dispatch_ahead=job.dispatch_ahead,
+                scheduler=scheduler,
+            ).run()
+        except Exception as e:
+            print(f"Error in job {job.name}:", e)
+
+    await asyncio.gather(*[run_job(job) for job in jobs])
 
 async def main():
     bot = Bot()
@@ -405,28 +1523,74 @@ async def main():
         password=settings.password
     )
 
-    # Chat to catch from
-    origin_group = -1001697666550
+    # The other accounts share the work, each with its own limits
+    for account in settings.accounts:
+        shard = Bot(account, spool=bot.spool)
+        await shard.start(
+            phone=account.phone_number,
+            password=account.password
+        )
+        bot.add_shard(shard)
 
-    # Chat to send to
-    destiny_group = 7924621890 
+    # A single progress line for all the jobs and accounts
+    reporter.interval = settings.progress_interval
 
-    # Topic that you want to send
-    # topic_id = 
+    # Where the time of every message goes, when asked for
+    if settings.trace_file:
+        tracer.open(settings.trace_file)
+        print(f"Tracing to {settings.trace_file}")
 
-    
-    # The last message it stoped
-    offset_id = 120
+    # Metrics for prometheus, on a local port
+    metrics_server = None
+    if settings.metrics_port:
+        metrics_server = await metrics.serve(
+            settings.metrics_host, settings.metrics_port
+        )
+        print(
+            "Metrics on"
+            f" http://{settings.metrics_host}:{settings.metrics_port}/metrics"
+        )
 
-    print("\n>>> Cloner up and running.\n")
-    await bot.clone_messages(
-        origin_group_id=origin_group,
-        destiny_group_id=destiny_group,
-        # topic_id=topic_id,
-        offset_id=offset_id
+    # Where every job stopped, they go on from there
+    checkpoints = CheckpointStore(
+        settings.checkpoints_file, settings.checkpoint_interval
     )
 
-    await bot.disconnect()
+    try:
+        # Many chats at once, from the jobs file
+        jobs = load_jobs(settings.jobs_file)
+        if jobs:
+            print(f"\n>>> Cloner up and running {len(jobs)} jobs.\n")
+            await run_jobs(bot, jobs, checkpoints)
+
+        else:
+            # Chat to catch from
+            origin_group = -1001697666550
+
+            # Chat to send to
+            destiny_group = 7924621890
+
+            # Topic that you want to send
+            # topic_id =
+
+            print("\n>>> Cloner up and running.\n")
+            await bot.clone_messages(
+                origin_group_id=origin_group,
+                destiny_group_id=destiny_group,
+                # topic_id=topic_id,
+                checkpoints=checkpoints,
+            )
+
+    finally:
+        reporter.stop()
+        if metrics_server:
+            metrics_server.close()
+        await tracer.close()
+        checkpoints.close()
+
+    for shard in bot.shards:
+        await close_sender_pool(shard)
+        await shard.disconnect()
 
 if __name__ == "__main__":
     asyncio.run(main())
@@ -0,0 +1,8 @@
+import os
+
+# main.py reads the settings when it's imported, the tests never log in
+os.environ.setdefault("ACCOUNT_NAME", "test")
+os.environ.setdefault("PHONE_NUMBER", "0")
+os.environ.setdefault("PASSWORD", "")
+os.environ.setdefault("API_ID", "1")
+os.environ.setdefault("API_HASH", "test")
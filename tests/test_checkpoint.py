@@ -0,0 +1,93 @@
+import pytest
+
+from bot.checkpoint import (
+    DOWNLOADED,
+    FAILED,
+    QUEUED,
+    SENT,
+    SKIPPED,
+    CheckpointStore,
+)
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = CheckpointStore(str(tmp_path / "checkpoints.db"))
+    yield store
+    store.close()
+
+
+def test_new_job_has_no_offset(store):
+    assert store.resume("job") == (None, set())
+
+
+def test_finished_job_goes_on_after_its_last_message(store):
+    store.mark("job", [1, 2, 3], SENT, [11, 12, 13])
+    store.mark("job", [4], SKIPPED)
+
+    assert store.resume("job") == (4, set())
+
+
+def test_resumes_right_before_the_first_open_message(store):
+    store.mark("job", [1, 2], SENT)
+    store.mark("job", [3], DOWNLOADED)
+    store.mark("job", [4, 5], SENT)
+    store.mark("job", [6], QUEUED)
+    store.mark("job", [7], SKIPPED)
+
+    offset, done = store.resume("job")
+
+    assert offset == 2
+    assert done == {4, 5, 7}
+
+
+def test_failed_messages_are_tried_again(store):
+    store.mark("job", [1], SENT)
+    store.mark("job", [2], FAILED)
+    store.mark("job", [3], SENT)
+
+    assert store.resume("job") == (1, {3})
+
+
+def test_later_status_replaces_the_earlier_one(store):
+    store.mark("job", [1], QUEUED)
+    store.mark("job", [1], SENT)
+
+    assert store.resume("job") == (1, set())
+
+
+def test_jobs_dont_see_each_other(store):
+    store.mark("first", [1, 2], SENT)
+    store.mark("second", [5], QUEUED)
+
+    assert store.resume("first") == (2, set())
+    assert store.resume("second") == (4, set())
+    assert store.resume("third") == (None, set())
+
+
+def test_pending_marks_survive_a_restart(tmp_path):
+    path = str(tmp_path / "checkpoints.db")
+    store = CheckpointStore(path, commit_interval=60)
+    store.mark("job", [1, 2], SENT)
+    store.mark("job", [3], QUEUED)
+    store.close()
+
+    store = CheckpointStore(path)
+    try:
+        assert store.resume("job") == (2, set())
+    finally:
+        store.close()
+
+
+def test_destiny_ids_pair_by_position_and_are_kept(store):
+    store.mark("job", [1, 2, 3], SENT, [11, None, 13])
+    store.commit()
+
+    # A later status without an id doesn't lose the one already known
+    store.mark("job", [1], FAILED)
+    store.commit()
+
+    rows = store.connection.execute(
+        "SELECT message_id, destiny_id FROM messages ORDER BY message_id"
+    ).fetchall()
+    assert rows == [(1, 11), (2, None), (3, 13)]
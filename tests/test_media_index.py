@@ -0,0 +1,125 @@
+import sqlite3
+from types import SimpleNamespace
+
+import pytest
+
+from bot.checkpoint import CheckpointStore
+from bot.media_index import MediaIndex
+
+FIRST = SimpleNamespace(id=1, access_hash=10)
+REPOST = SimpleNamespace(id=2, access_hash=20)
+OTHER = SimpleNamespace(id=3, access_hash=30)
+
+
+@pytest.fixture
+def index():
+    store = CheckpointStore(":memory:")
+    yield store.media
+    store.close()
+
+
+def write(path):
+    path.write_bytes(b"content")
+    return str(path)
+
+
+def test_unknown_media_has_no_file_or_destiny(index):
+    assert index.file(FIRST) is None
+    assert index.destiny(FIRST, 100, "") is None
+
+
+def test_file_is_found_while_it_is_on_disk(index, tmp_path):
+    file_path = write(tmp_path / "first.bin")
+    index.add_file(FIRST, file_path, "hash")
+
+    assert index.file(FIRST) == file_path
+
+    (tmp_path / "first.bin").unlink()
+    assert index.file(FIRST) is None
+
+
+def test_repost_with_the_same_content_finds_the_file(index, tmp_path):
+    file_path = write(tmp_path / "first.bin")
+    index.add_file(FIRST, file_path, "hash")
+    index.add_file(REPOST, str(tmp_path / "gone.bin"), "hash")
+    index.add_file(OTHER, str(tmp_path / "other.bin"), "other")
+
+    # The repost's own file is gone, the first one still has it
+    assert index.file(REPOST) == file_path
+    assert index.file(OTHER) is None
+
+
+def test_forgotten_file_is_not_found(index, tmp_path):
+    index.add_file(FIRST, write(tmp_path / "first.bin"), "hash")
+
+    index.forget_file(FIRST)
+
+    assert index.file(FIRST) is None
+
+
+def test_destiny_is_kept_by_chat_and_account(index):
+    index.add_sent(FIRST, 100, "first", 7)
+    index.add_sent(FIRST, 100, "second", 9)
+
+    assert index.destiny(FIRST, 100, "first") == 7
+    assert index.destiny(FIRST, 100, "second") == 9
+    assert index.destiny(FIRST, 100, "third") is None
+    assert index.destiny(FIRST, 200, "first") is None
+
+
+def test_sent_again_replaces_the_destiny(index):
+    index.add_sent(FIRST, 100, "", 7)
+    index.add_sent(FIRST, 100, "", 8)
+
+    assert index.destiny(FIRST, 100, "") == 8
+
+
+def test_repost_with_the_same_content_finds_the_destiny(index, tmp_path):
+    index.add_file(FIRST, str(tmp_path / "first.bin"), "hash")
+    index.add_file(REPOST, str(tmp_path / "repost.bin"), "hash")
+    index.add_sent(FIRST, 100, "", 7)
+
+    assert index.destiny(REPOST, 100, "") == 7
+    assert index.destiny(OTHER, 100, "") is None
+
+
+def test_media_without_content_hash_matches_only_itself(index):
+    # Sent without a download, its content is unknown
+    index.add_sent(FIRST, 100, "", 7)
+    index.add_sent(REPOST, 100, "", 8)
+
+    assert index.destiny(FIRST, 100, "") == 7
+    assert index.destiny(REPOST, 100, "") == 8
+    assert index.destiny(OTHER, 100, "") is None
+
+
+def test_forgotten_destiny_is_not_sent_from(index):
+    index.add_sent(FIRST, 100, "first", 7)
+    index.add_sent(REPOST, 100, "second", 7)
+
+    index.forget_sent(100, "first", 7)
+
+    assert index.destiny(FIRST, 100, "first") is None
+    assert index.destiny(REPOST, 100, "second") == 7
+
+
+def test_destinies_without_account_are_dropped(tmp_path):
+    path = str(tmp_path / "checkpoints.db")
+    connection = sqlite3.connect(path)
+    connection.execute(
+        "CREATE TABLE media_sent ("
+        " document_id INTEGER NOT NULL,"
+        " access_hash INTEGER NOT NULL,"
+        " destiny_chat INTEGER NOT NULL,"
+        " destiny_id INTEGER NOT NULL,"
+        " PRIMARY KEY (document_id, access_hash, destiny_chat))"
+    )
+    connection.execute("INSERT INTO media_sent VALUES (1, 10, 100, 7)")
+    connection.commit()
+
+    index = MediaIndex(connection)
+
+    assert index.destiny(FIRST, 100, "") is None
+    index.add_sent(FIRST, 100, "", 8)
+    assert index.destiny(FIRST, 100, "") == 8
+    connection.close()
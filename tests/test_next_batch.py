@@ -0,0 +1,141 @@
+import asyncio
+from functools import partial
+from types import SimpleNamespace
+
+import pytest
+from telethon.tl.patched import Message, MessageService
+from telethon.tl.types import MessageActionPinMessage, PeerChannel
+
+from bot.checkpoint import CheckpointStore
+from main import Bot, CloneJob
+
+ORIGIN = SimpleNamespace(id=1, noforwards=False)
+
+
+def message(id, protected=False, grouped_id=None):
+    return Message(
+        id=id,
+        peer_id=PeerChannel(ORIGIN.id),
+        date=None,
+        message=f"message {id}",
+        noforwards=protected,
+        grouped_id=grouped_id,
+    )
+
+
+def service(id):
+    return MessageService(
+        id=id,
+        peer_id=PeerChannel(ORIGIN.id),
+        date=None,
+        action=MessageActionPinMessage(),
+    )
+
+
+@pytest.fixture
+def job(tmp_path):
+    store = CheckpointStore(":memory:")
+    bot = SimpleNamespace(
+        download_dir=tmp_path,
+        shards=[],
+        _is_forwardable=partial(Bot._is_forwardable, None),
+    )
+    yield CloneJob(
+        bot=bot,
+        name="job",
+        origin_group_id=ORIGIN.id,
+        destiny_group_id=2,
+        checkpoints=store,
+    )
+    store.close()
+
+
+def batches(job, messages):
+    # The whole history is already waiting, up to its end
+    for item in messages + [None]:
+        job.messages_queue.put_nowait(item)
+
+    async def run():
+        taken = []
+        while (batch := await job._next_batch(ORIGIN)) is not None:
+            taken.append([item.id for item in batch])
+        return taken
+
+    return asyncio.run(asyncio.wait_for(run(), 1))
+
+
+def test_forwardable_messages_go_together(job):
+    assert batches(job, [message(1), message(2), message(3)]) == [[1, 2, 3]]
+
+
+def test_service_messages_end_the_batch_and_go_alone(job):
+    history = [message(1), message(2), service(3), message(4)]
+
+    assert batches(job, history) == [[1, 2], [3], [4]]
+
+
+def test_protected_messages_end_the_batch_and_go_alone(job):
+    history = [message(1), message(2, protected=True), message(3)]
+
+    assert batches(job, history) == [[1], [2], [3]]
+
+
+def test_batches_stop_at_the_100_ids_telegram_accepts(job):
+    history = [message(id) for id in range(1, 251)]
+
+    assert [len(batch) for batch in batches(job, history)] == [100, 100, 50]
+
+
+def test_message_that_ends_a_batch_is_held_for_the_next(job):
+    for item in [message(1), message(2, protected=True), message(3)]:
+        job.messages_queue.put_nowait(item)
+
+    batch = asyncio.run(job._next_batch(ORIGIN))
+
+    assert [item.id for item in batch] == [1]
+    assert job.held_message.id == 2
+    assert job.messages_queue.qsize() == 1
+
+
+def test_protected_album_goes_together(job):
+    history = [
+        message(1, protected=True),
+        message(2, protected=True, grouped_id=7),
+        message(3, protected=True, grouped_id=7),
+        message(4, protected=True, grouped_id=8),
+        message(5),
+    ]
+
+    assert batches(job, history) == [[1], [2, 3], [4], [5]]
+
+
+def test_album_going_on_in_the_next_page_waits_for_it(job):
+    album = [message(id, protected=True, grouped_id=7) for id in (1, 2, 3)]
+
+    async def run():
+        # Only the first page of the history is here yet
+        for item in album[:2]:
+            job.messages_queue.put_nowait(item)
+
+        taking = asyncio.create_task(job._next_batch(ORIGIN))
+        await asyncio.sleep(0.01)
+        assert not taking.done()
+
+        # The prefetcher is asked for the next page
+        assert job.history_drained.is_set()
+
+        job.messages_queue.put_nowait(album[2])
+        job.messages_queue.put_nowait(message(4))
+        return await asyncio.wait_for(taking, 1)
+
+    batch = asyncio.run(run())
+
+    assert [item.id for item in batch] == [1, 2, 3]
+    assert job.held_message.id == 4
+
+
+def test_album_at_the_end_of_the_history_doesnt_wait(job):
+    album = [message(id, protected=True, grouped_id=7) for id in (1, 2)]
+
+    assert batches(job, album) == [[1, 2]]
+    assert job.history_ended
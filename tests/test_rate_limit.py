@@ -0,0 +1,117 @@
+import asyncio
+import time
+
+import pytest
+
+from bot.rate_limit import RateLimiter, TokenBucket
+
+
+def test_acquire_takes_a_waiting_token_right_away():
+    bucket = TokenBucket(inicial_tokens=2, max_tokens=2, refill_interval=60)
+
+    wait = asyncio.run(bucket.acquire())
+
+    assert wait == 0
+    assert bucket.tokens == pytest.approx(1, abs=0.01)
+    assert not bucket.limited
+
+
+def test_acquire_sleeps_until_the_token_refills():
+    bucket = TokenBucket(inicial_tokens=0, max_tokens=1, refill_interval=0.05)
+
+    started = time.monotonic()
+    wait = asyncio.run(bucket.acquire())
+
+    assert wait == pytest.approx(0.05, abs=0.01)
+    assert time.monotonic() - started >= 0.05
+    assert bucket.limited
+
+
+def test_acquire_lets_waiters_through_one_interval_apart():
+    bucket = TokenBucket(inicial_tokens=1, max_tokens=1, refill_interval=0.05)
+
+    async def run():
+        return await asyncio.gather(*[bucket.acquire() for _ in range(3)])
+
+    started = time.monotonic()
+    waits = asyncio.run(run())
+
+    assert waits[0] == 0
+    assert time.monotonic() - started >= 0.1
+
+
+def test_acquire_more_than_max_tokens_leaves_a_debt():
+    bucket = TokenBucket(inicial_tokens=1, max_tokens=1, refill_interval=60)
+
+    asyncio.run(bucket.acquire(3))
+
+    assert bucket.tokens == pytest.approx(-2, abs=0.01)
+
+
+def test_pause_holds_back_even_with_tokens_left():
+    bucket = TokenBucket(inicial_tokens=5, max_tokens=5, refill_interval=0.02)
+
+    bucket.pause(0.1)
+    started = time.monotonic()
+    asyncio.run(bucket.acquire())
+
+    assert time.monotonic() - started >= 0.1
+
+
+def test_limiter_keeps_a_bucket_per_kind_and_chat():
+    limiter = RateLimiter(rates={"send": 20, "upload": 5})
+
+    assert limiter.bucket("send", 1) is limiter.bucket("send", 1)
+    assert limiter.bucket("send", 1) is not limiter.bucket("send", 2)
+    assert limiter.bucket("send", 1) is not limiter.bucket("upload", 1)
+    assert limiter.rate("send", 1) == pytest.approx(20)
+    assert limiter.rate("upload", 1) == pytest.approx(5)
+
+
+def test_flood_halves_the_rate_and_pauses_the_bucket():
+    limiter = RateLimiter(rates={"send": 20}, min_rate=1, max_rate=60)
+
+    limiter.flood("send", 1, seconds=30)
+
+    assert limiter.rate("send", 1) == pytest.approx(10)
+    assert limiter.bucket("send", 1).tokens < 0
+    assert limiter.rate("send", 2) == pytest.approx(20)
+
+
+def test_flood_never_goes_below_min_rate():
+    limiter = RateLimiter(rates={"send": 3}, min_rate=2, max_rate=60)
+
+    limiter.flood("send", 1, seconds=1)
+    limiter.flood("send", 1, seconds=1)
+
+    assert limiter.rate("send", 1) == pytest.approx(2)
+
+
+def test_success_raises_the_rate_only_when_limited():
+    limiter = RateLimiter(rates={"send": 20}, min_rate=1, max_rate=60)
+
+    limiter.success("send", 1)
+    assert limiter.rate("send", 1) == pytest.approx(20)
+
+    limiter.bucket("send", 1).limited = True
+    limiter.success("send", 1)
+    assert limiter.rate("send", 1) == pytest.approx(20 + 1 / 20)
+
+
+def test_success_stops_at_max_rate():
+    limiter = RateLimiter(rates={"send": 59.99}, min_rate=1, max_rate=60)
+    limiter.bucket("send", 1).limited = True
+
+    for _ in range(10):
+        limiter.success("send", 1)
+
+    assert limiter.rate("send", 1) == pytest.approx(60)
+
+
+def test_success_keeps_a_rate_configured_above_max_rate():
+    limiter = RateLimiter(rates={"upload": 120}, min_rate=1, max_rate=60)
+    limiter.bucket("upload", 1).limited = True
+
+    limiter.success("upload", 1)
+
+    assert limiter.rate("upload", 1) == pytest.approx(120)
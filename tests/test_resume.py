@@ -0,0 +1,217 @@
+import asyncio
+import hashlib
+import json
+import os
+import time
+from types import SimpleNamespace
+
+from benchmarks.fake_server import FakeClient, FakeFileServer
+from bot.FastTelethon import close_sender_pool, fast_download, fast_upload
+from bot.resume import DownloadSidecar, UploadSession
+
+PART_SIZE = 64 * 1024
+PARTS = 16
+
+
+class DroppingServer(FakeFileServer):
+    """
+    Drops the connection on every request after the first drop_after.
+    """
+
+    drop_after = None
+
+    async def call(self, sender, request):
+        if self.drop_after is not None and self.requests >= self.drop_after:
+            raise ConnectionError("connection dropped")
+        return await super().call(sender, request)
+
+
+def pinned_client(server):
+    # Same part size on every attempt, whatever the tuner learned
+    client = FakeClient(server)
+    client.pool.tuner.connection_count = lambda dc_id, file_size: 2
+    client.pool.tuner.part_size_for = lambda dc_id, file_size: PART_SIZE
+    return client
+
+
+def download(server, document, file_path):
+    async def run():
+        client = pinned_client(server)
+        try:
+            await fast_download(
+                client=client,
+                message=SimpleNamespace(document=document),
+                file_path=file_path,
+            )
+        finally:
+            await close_sender_pool(client)
+
+    asyncio.run(run())
+
+
+def interrupted_download(tmp_path, drop_after=6):
+    data = os.urandom(PART_SIZE * PARTS)
+    server = DroppingServer(latency=0)
+    document = server.add_file(1234, data)
+    file_path = str(tmp_path / "file.bin")
+
+    server.drop_after = drop_after
+    try:
+        download(server, document, file_path)
+    except ConnectionError:
+        pass
+    else:
+        raise AssertionError("the download should have dropped")
+    server.drop_after = None
+
+    return data, server, document, file_path
+
+
+def saved_parts(file_path):
+    with open(f"{file_path}.parts") as file:
+        return {int(part) for part in json.load(file)["parts"]}
+
+
+def test_sidecar_is_saved_before_the_first_part(tmp_path):
+    file_path = str(tmp_path / "file.bin")
+    sidecar = DownloadSidecar(file_path, document_id=1, file_size=100)
+
+    with open(file_path, "wb") as out:
+        assert sidecar.start(out, part_size=10) == set()
+
+    assert os.path.exists(sidecar.path)
+
+
+def test_interrupted_download_keeps_its_sidecar(tmp_path):
+    _, _, _, file_path = interrupted_download(tmp_path)
+
+    assert os.path.exists(f"{file_path}.parts")
+    assert 0 < len(saved_parts(file_path)) < PARTS
+
+
+def test_resumed_download_only_fetches_the_missing_parts(tmp_path):
+    data, server, document, file_path = interrupted_download(tmp_path)
+    done = saved_parts(file_path)
+
+    before = server.requests
+    download(server, document, file_path)
+
+    assert server.requests - before == PARTS - len(done)
+    with open(file_path, "rb") as file:
+        assert file.read() == data
+    assert not os.path.exists(f"{file_path}.parts")
+
+
+def test_parts_that_dont_match_their_checksum_are_fetched_again(tmp_path):
+    data, server, document, file_path = interrupted_download(tmp_path)
+    done = saved_parts(file_path)
+
+    # Half written when the process died
+    broken = min(done)
+    with open(file_path, "r+b") as file:
+        file.seek(broken * PART_SIZE)
+        file.write(b"\0" * 10)
+
+    before = server.requests
+    download(server, document, file_path)
+
+    assert server.requests - before == PARTS - len(done) + 1
+    with open(file_path, "rb") as file:
+        assert file.read() == data
+
+
+def test_sidecar_of_another_document_starts_over(tmp_path):
+    data, server, _, file_path = interrupted_download(tmp_path)
+
+    # Same path, different media
+    other = server.add_file(5678, data)
+    before = server.requests
+    download(server, other, file_path)
+
+    assert server.requests - before == PARTS
+    with open(file_path, "rb") as file:
+        assert file.read() == data
+
+
+def upload(server, file_path):
+    async def run():
+        client = pinned_client(server)
+        try:
+            return await fast_upload(client=client, file_path=file_path)
+        finally:
+            await close_sender_pool(client)
+
+    return asyncio.run(run())
+
+
+def interrupted_upload(tmp_path, drop_after=6):
+    data = os.urandom(PART_SIZE * PARTS)
+    file_path = str(tmp_path / "file.bin")
+    with open(file_path, "wb") as file:
+        file.write(data)
+
+    server = DroppingServer(latency=0)
+    server.drop_after = drop_after
+    try:
+        upload(server, file_path)
+    except ConnectionError:
+        pass
+    else:
+        raise AssertionError("the upload should have dropped")
+    server.drop_after = None
+
+    return data, server, file_path
+
+
+def test_interrupted_upload_keeps_the_acknowledged_parts(tmp_path):
+    _, server, file_path = interrupted_upload(tmp_path)
+
+    with open(f"{file_path}.upload") as file:
+        state = json.load(file)
+    assert set(state["parts"]) == set(server.uploads[state["file_id"]])
+    assert 0 < len(state["parts"]) < PARTS
+
+
+def test_resumed_upload_only_sends_the_missing_parts(tmp_path):
+    data, server, file_path = interrupted_upload(tmp_path)
+    with open(f"{file_path}.upload") as file:
+        state = json.load(file)
+
+    before = server.requests
+    uploaded = upload(server, file_path)
+
+    # Same file_id, so telegram puts the old parts and the new together
+    assert uploaded.id == state["file_id"]
+    assert server.requests - before == PARTS - len(state["parts"])
+    assert server.uploaded(uploaded.id) == data
+    assert uploaded.md5_checksum == hashlib.md5(data).hexdigest()
+
+
+def test_upload_session_of_another_file_or_dc_starts_over(tmp_path):
+    session = UploadSession(str(tmp_path / "file.bin"))
+    session.start(file_id=1, file_size=100, part_size=10, dc_id=2)
+    session.add(0)
+    session.save()
+
+    again = UploadSession(str(tmp_path / "file.bin"))
+    assert again.start(9, 100, 10, 2) == {0}
+    assert again.file_id == 1
+
+    assert again.start(9, 200, 10, 2) == set()
+    assert again.file_id == 9
+    assert again.start(9, 100, 10, 4) == set()
+
+
+def test_upload_session_too_old_starts_over(tmp_path):
+    session = UploadSession(str(tmp_path / "file.bin"))
+    session.start(file_id=1, file_size=100, part_size=10, dc_id=2)
+    session.add(0)
+    session.save()
+
+    with open(session.path) as file:
+        state = json.load(file)
+    state["updated"] = time.time() - UploadSession.max_age - 1
+    with open(session.path, "w") as file:
+        json.dump(state, file)
+
+    assert UploadSession(session.file_path).start(9, 100, 10, 2) == set()
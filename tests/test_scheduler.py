@@ -0,0 +1,108 @@
+import asyncio
+
+from bot.scheduler import FairScheduler
+
+
+def test_free_slots_are_granted_right_away():
+    async def run():
+        scheduler = FairScheduler(slots=2)
+        await asyncio.wait_for(scheduler.acquire("a"), 0.1)
+        await asyncio.wait_for(scheduler.acquire("a"), 0.1)
+        return scheduler
+
+    scheduler = asyncio.run(run())
+
+    assert scheduler.used == 2
+
+
+def test_jobs_take_turns_for_the_slots():
+    granted = []
+
+    async def run():
+        scheduler = FairScheduler(slots=1)
+        await scheduler.acquire("big")
+
+        async def acquire(job):
+            await scheduler.acquire(job)
+            granted.append(job)
+
+        # The big job asked for many before the small one asked at all
+        tasks = [asyncio.create_task(acquire("big")) for _ in range(3)]
+        await asyncio.sleep(0)
+        tasks += [asyncio.create_task(acquire("small")) for _ in range(2)]
+        await asyncio.sleep(0)
+
+        for _ in tasks:
+            scheduler.release()
+            await asyncio.sleep(0)
+        await asyncio.wait_for(asyncio.gather(*tasks), 0.1)
+
+    asyncio.run(run())
+
+    assert granted == ["big", "small", "big", "small", "big"]
+
+
+def test_a_new_job_waits_behind_the_ones_already_waiting():
+    granted = []
+
+    async def run():
+        scheduler = FairScheduler(slots=1)
+        await scheduler.acquire("a")
+
+        async def acquire(job):
+            await scheduler.acquire(job)
+            granted.append(job)
+
+        waiting = asyncio.create_task(acquire("b"))
+        await asyncio.sleep(0)
+
+        # A slot frees, but "b" asked first
+        scheduler.release()
+        late = asyncio.create_task(acquire("c"))
+        await asyncio.sleep(0)
+
+        scheduler.release()
+        await asyncio.wait_for(asyncio.gather(waiting, late), 0.1)
+
+    asyncio.run(run())
+
+    assert granted == ["b", "c"]
+
+
+def test_a_cancelled_waiter_doesnt_take_a_slot():
+    async def run():
+        scheduler = FairScheduler(slots=1)
+        await scheduler.acquire("a")
+
+        cancelled = asyncio.create_task(scheduler.acquire("b"))
+        waiting = asyncio.create_task(scheduler.acquire("c"))
+        await asyncio.sleep(0)
+
+        cancelled.cancel()
+        scheduler.release()
+        await asyncio.wait_for(waiting, 0.1)
+        return scheduler
+
+    scheduler = asyncio.run(run())
+
+    assert scheduler.used == 1
+    assert not scheduler.waiting
+
+
+def test_cancelled_right_after_the_grant_gives_the_slot_back():
+    async def run():
+        scheduler = FairScheduler(slots=1)
+        await scheduler.acquire("a")
+
+        cancelled = asyncio.create_task(scheduler.acquire("b"))
+        await asyncio.sleep(0)
+
+        # Granted, but cancelled before it got to run
+        scheduler.release()
+        cancelled.cancel()
+        await asyncio.gather(cancelled, return_exceptions=True)
+        return scheduler
+
+    scheduler = asyncio.run(run())
+
+    assert scheduler.used == 0
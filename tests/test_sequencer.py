@@ -0,0 +1,92 @@
+import asyncio
+
+from bot.sequencer import Sequencer
+
+
+def test_numbers_go_up_from_zero():
+    sequencer = Sequencer()
+
+    assert [sequencer.number() for _ in range(3)] == [0, 1, 2]
+
+
+def test_first_number_and_none_never_wait():
+    sequencer = Sequencer()
+    first = sequencer.number()
+
+    async def run():
+        await asyncio.wait_for(sequencer.wait(first), 0.1)
+        await asyncio.wait_for(sequencer.wait(None), 0.1)
+
+    asyncio.run(run())
+
+
+def test_waiters_land_in_number_order():
+    sequencer = Sequencer()
+    numbers = [sequencer.number() for _ in range(4)]
+    landed = []
+
+    async def send(number, delay):
+        # The later ones finish their work first
+        await asyncio.sleep(delay)
+        await sequencer.wait(number)
+        landed.append(number)
+        sequencer.done(number)
+
+    async def run():
+        await asyncio.gather(
+            *[
+                send(number, 0.04 - number * 0.01)
+                for number in numbers
+            ]
+        )
+
+    asyncio.run(run())
+
+    assert landed == numbers
+
+
+def test_turn_moves_on_only_once_everything_before_is_done():
+    sequencer = Sequencer()
+    first, second, third = (sequencer.number() for _ in range(3))
+
+    async def run():
+        waiting = asyncio.create_task(sequencer.wait(third))
+
+        # Done out of order, the third still waits for the first
+        sequencer.done(second)
+        await asyncio.sleep(0.01)
+        assert not waiting.done()
+
+        sequencer.done(first)
+        await asyncio.wait_for(waiting, 0.1)
+
+    asyncio.run(run())
+
+    assert sequencer.next == third
+
+
+def test_a_cancelled_waiter_doesnt_hold_the_others():
+    sequencer = Sequencer()
+    first, second = sequencer.number(), sequencer.number()
+
+    async def run():
+        cancelled = asyncio.create_task(sequencer.wait(second))
+        waiting = asyncio.create_task(sequencer.wait(second))
+        await asyncio.sleep(0)
+        cancelled.cancel()
+
+        sequencer.done(first)
+        await asyncio.wait_for(waiting, 0.1)
+
+    asyncio.run(run())
+
+
+def test_done_twice_or_for_old_numbers_is_ignored():
+    sequencer = Sequencer()
+    first, second = sequencer.number(), sequencer.number()
+
+    sequencer.done(first)
+    sequencer.done(first)
+    sequencer.done(None)
+
+    assert sequencer.next == second
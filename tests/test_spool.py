@@ -0,0 +1,183 @@
+import asyncio
+import os
+
+from bot.spool import Spool
+
+
+def write(path, size):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_bytes(b"x" * size)
+    return str(path)
+
+
+def test_reserve_within_budget_is_granted_right_away(tmp_path):
+    async def run():
+        spool = Spool(tmp_path, budget=100)
+        await asyncio.wait_for(spool.reserve(60), 0.1)
+        await asyncio.wait_for(spool.reserve(40), 0.1)
+        return spool
+
+    spool = asyncio.run(run())
+
+    assert spool.reserved == 100
+
+
+def test_reserve_waits_until_an_upload_frees_the_room(tmp_path):
+    async def run():
+        spool = Spool(tmp_path, budget=100)
+        file_path = write(tmp_path / "a.bin", 80)
+        spool.use(file_path)
+
+        waiting = asyncio.create_task(spool.reserve(50))
+        await asyncio.sleep(0.01)
+        assert not waiting.done()
+
+        # Uploaded, and with no cache it's removed for the room
+        spool.release(file_path)
+        await asyncio.wait_for(waiting, 0.1)
+        return spool, file_path
+
+    spool, file_path = asyncio.run(run())
+
+    assert spool.reserved == 50
+    assert not os.path.exists(file_path)
+
+
+def test_reservations_are_granted_in_order(tmp_path):
+    granted = []
+
+    async def run():
+        spool = Spool(tmp_path, budget=100)
+        await spool.reserve(90)
+
+        async def reserve(name, size):
+            await spool.reserve(size)
+            granted.append(name)
+
+        big = asyncio.create_task(reserve("big", 50))
+        await asyncio.sleep(0.01)
+        small = asyncio.create_task(reserve("small", 5))
+        await asyncio.sleep(0.01)
+
+        # The small one fits, but the big one asked first
+        assert granted == []
+
+        spool.unreserve(90)
+        await asyncio.wait_for(asyncio.gather(big, small), 0.1)
+
+    asyncio.run(run())
+
+    assert granted == ["big", "small"]
+
+
+def test_turn_grants_the_reservation_over_the_budget(tmp_path):
+    async def run():
+        spool = Spool(tmp_path, budget=100)
+        spool.use(write(tmp_path / "later.bin", 90))
+        turn = asyncio.Event()
+
+        waiting = asyncio.create_task(spool.reserve(50, turn=turn.wait))
+        await asyncio.sleep(0.01)
+        assert not waiting.done()
+
+        turn.set()
+        await asyncio.wait_for(waiting, 0.1)
+        return spool
+
+    spool = asyncio.run(run())
+
+    assert spool.size + spool.reserved == 140
+
+
+def test_something_bigger_than_the_budget_goes_alone(tmp_path):
+    async def run():
+        spool = Spool(tmp_path, budget=100)
+        await asyncio.wait_for(spool.reserve(500), 0.1)
+
+    asyncio.run(run())
+
+
+def test_release_keeps_the_newest_files_up_to_cache_size(tmp_path):
+    async def run():
+        spool = Spool(tmp_path, budget=1000, cache_size=100)
+        paths = [write(tmp_path / f"{n}.bin", 60) for n in range(3)]
+        for path in paths:
+            spool.use(path)
+        for path in paths:
+            spool.release(path)
+        return spool, paths
+
+    spool, paths = asyncio.run(run())
+
+    assert [os.path.exists(path) for path in paths] == [False, False, True]
+    assert list(spool.cache) == [paths[2]]
+    assert spool.size == 60
+
+
+def test_cached_files_are_evicted_with_their_sidecars(tmp_path):
+    async def run():
+        spool = Spool(tmp_path, budget=100, cache_size=100)
+        file_path = write(tmp_path / "a.bin", 80)
+        write(tmp_path / "a.bin.upload", 1)
+        spool.use(file_path)
+        spool.release(file_path)
+
+        await asyncio.wait_for(spool.reserve(50), 0.1)
+        return file_path
+
+    file_path = asyncio.run(run())
+
+    assert not os.path.exists(file_path)
+    assert not os.path.exists(f"{file_path}.upload")
+
+
+def test_files_waiting_for_upload_are_never_evicted(tmp_path):
+    async def run():
+        spool = Spool(tmp_path, budget=100, cache_size=0)
+        file_path = write(tmp_path / "a.bin", 80)
+        spool.use(file_path)
+
+        waiting = asyncio.create_task(spool.reserve(50))
+        await asyncio.sleep(0.01)
+        waiting.cancel()
+        return file_path
+
+    file_path = asyncio.run(run())
+
+    assert os.path.exists(file_path)
+
+
+def test_scan_caches_what_earlier_runs_left(tmp_path):
+    old = write(tmp_path / "job" / "old.bin", 60)
+    new = write(tmp_path / "job" / "new.bin", 60)
+    os.utime(old, (1, 1))
+
+    async def run():
+        return Spool(tmp_path, budget=1000, cache_size=100)
+
+    spool = asyncio.run(run())
+
+    # Trimmed to the cache size, the oldest first
+    assert not os.path.exists(old)
+    assert list(spool.cache) == [new]
+    assert spool.size == 60
+
+
+def test_scan_leaves_transfers_to_resume_alone(tmp_path):
+    partial = write(tmp_path / "job" / "partial.bin", 500)
+    write(tmp_path / "job" / "partial.bin.parts", 1)
+    uploading = write(tmp_path / "job" / "uploading.bin", 500)
+    write(tmp_path / "job" / "uploading.bin.upload", 1)
+    orphan = write(tmp_path / "job" / "gone.bin.parts", 1)
+
+    async def run():
+        return Spool(tmp_path, budget=1000, cache_size=100)
+
+    spool = asyncio.run(run())
+
+    assert os.path.exists(partial)
+    assert os.path.exists(f"{partial}.parts")
+    assert os.path.exists(uploading)
+    assert not os.path.exists(orphan)
+    assert spool.size == 0
+    assert not spool.cache